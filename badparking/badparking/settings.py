@@ -131,8 +131,36 @@ AUTH_USER_MODEL = 'profiles.User'
 STATIC_URL = '/static/'
 MEDIA_ROOT = normpath(join(BASE_DIR, '../image_storage'))
 MEDIA_URL = '/media/'
+# Set to 'media.storage.S3Storage' to keep uploads and thumbnails in an S3 compatible object storage
+DEFAULT_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
+MEDIA_S3 = {
+    'bucket': '',
+    'endpoint_url': None,
+    'region_name': None,
+    'access_key_id': None,
+    'secret_access_key': None,
+    # Public URL of the bucket, files are served by presigned URLs if it's not set
+    'base_url': None,
+    'url_expiration': 3600,
+    'max_pool_connections': 20,
+    'multipart_threshold': 8 * 1024 * 1024,
+    'multipart_chunksize': 8 * 1024 * 1024,
+    'spool_size': 1024 * 1024,
+}
 
-IMAGEKIT_SPEC_CACHEFILE_NAMER = 'imagekit.cachefiles.namers.hash'
+IMAGEKIT_SPEC_CACHEFILE_NAMER = 'media.thumbnails.sharded_hash_namer'
+# Levels of hash prefix subdirectories uploads and thumbnails are spread over, see `relocatemedia` when changing
+MEDIA_SHARD_LEVELS = 2
+# Number of threads generating thumbnails in the background
+MEDIA_THUMBNAIL_WORKERS = 2
+# Uploaded images are turned upright, stripped of metadata and downscaled to fit the max dimension
+MEDIA_IMAGE_NORMALIZATION = True
+MEDIA_IMAGE_MAX_DIMENSION = 2048
+MEDIA_IMAGE_QUALITY = 85
+# Resumable uploads are assembled here, on the same file system the storage moves them into place from
+MEDIA_UPLOAD_TEMP_DIR = join(MEDIA_ROOT, 'uploads')
+MEDIA_UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+MEDIA_UPLOAD_BUFFER_SIZE = 64 * 1024
 
 
 SWAGGER_SETTINGS = {
@@ -155,7 +183,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_jwt.authentication.JSONWebTokenAuthentication',
+        'profiles.authentication.JSONWebTokenUserAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': (
         'rest_framework.filters.DjangoFilterBackend',
@@ -181,6 +209,9 @@ JWT_AUTH = {
 }
 
 
+# Users loaded by the JWT authentication are shared between the requests for a short time
+PROFILE_USER_CACHE_TIMEOUT = 30
+
 BANKID_OSCHADBANK = {
     'client_id': None,
     'client_secret': None
@@ -195,8 +226,25 @@ BANKID_PRIVATBANK = {
 }
 
 API_CLIENT_TIMESTAMP_THRESHOLD = 120  # 2 minutes difference is allowed between current time and API timestamp
+API_CLIENT_CACHE_TIMEOUT = 60  # Seconds an API client is kept in the shared cache
+API_CLIENT_LOCAL_CACHE_TIMEOUT = 5  # Seconds an API client is kept in process memory
+API_CLIENT_SIGNATURE_CACHE_SIZE = 1024  # Number of verified signatures kept in process memory
+API_CLIENT_REPLAY_PROTECTION = False  # Reject signatures used more than once
 
 FACEBOOK_APP_SECRET = None
+FACEBOOK_API_URL = 'https://graph.facebook.com'
+FACEBOOK_API_TIMEOUT = (3.05, 10)  # Seconds to connect and then to wait for a response
+FACEBOOK_API_RETRIES = 2
+FACEBOOK_API_POOL_SIZE = 10
+
+POLICE_FEEDBACK = {
+    'url': None,
+    'client_id': None,
+    'client_secret': None,
+    'timeout': 10,  # Seconds for connecting and then for reading the response of each request
+    'max_workers': 4,  # Batches of claims requested concurrently
+    'retries': 3
+}
 
 CITIES_WHITELIST = ('київ', 'киев', 'kyiv', 'kiev')
 
@@ -33,6 +33,11 @@ class ClaimAdmin(admin.ModelAdmin):
     list_filter = ('status', 'crimetypes')
     search_fields = ('id', 'license_plates', 'city', 'address', 'user__email', 'user__last_name')
 
+    def save_related(self, request, form, formsets, change):
+        super(ClaimAdmin, self).save_related(request, form, formsets, change)
+        # The media inline edits the relation directly, bypassing `Claim.attach_media`
+        form.instance.sync_uploaded_filenames()
+
 
 admin.site.register(CrimeType, CrimeTypeAdmin)
 admin.site.register(Claim, ClaimAdmin)
@@ -19,3 +19,22 @@ CLAIM_STATUS_CHOICES = (
 )
 
 CLAIM_ACTIVE_STATUSES = (CLAIM_STATUS_ENQUEUED, CLAIM_STATUS_ACCEPTED, CLAIM_STATUS_IN_PROGRESS)
+
+CLAIM_CANCELABLE_STATUSES = (CLAIM_STATUS_RECEIVED, CLAIM_STATUS_COMPLETE)
+
+# Allowed transitions, as target status to the statuses a claim may move to it from
+CLAIM_STATUS_TRANSITIONS = {
+    CLAIM_STATUS_COMPLETE: (CLAIM_STATUS_RECEIVED,),
+    CLAIM_STATUS_ENQUEUED: (CLAIM_STATUS_COMPLETE,),
+    CLAIM_STATUS_ACCEPTED: (CLAIM_STATUS_ENQUEUED,),
+    CLAIM_STATUS_IN_PROGRESS: (CLAIM_STATUS_ENQUEUED, CLAIM_STATUS_ACCEPTED),
+    CLAIM_STATUS_RESOLVED: CLAIM_ACTIVE_STATUSES,
+    CLAIM_STATUS_INVALID: (CLAIM_STATUS_COMPLETE,) + CLAIM_ACTIVE_STATUSES,
+    CLAIM_STATUS_CANCELED: CLAIM_CANCELABLE_STATUSES,
+}
+
+# Outcomes of bulk claim transitions
+CLAIM_TRANSITION_DONE = 'done'  # Claim moved to the new status
+CLAIM_TRANSITION_UNCHANGED = 'unchanged'  # Claim already had the status
+CLAIM_TRANSITION_NOT_ALLOWED = 'not_allowed'  # Claim can't move to the status from its current one
+CLAIM_TRANSITION_NOT_FOUND = 'not_found'  # No such claim in the queryset
@@ -0,0 +1,65 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+
+def iterate_batches(queryset, batch_size):
+    """
+    Yields lists of up to `batch_size` objects of the `queryset` in primary key order.
+
+    Batches are sliced by the last seen primary key instead of OFFSET, so each one is an index range scan and rows
+    leaving the queryset in between (e.g. by changing status) neither shift the following batches nor get visited
+    twice.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        batch_qs = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        batch = list(batch_qs[:batch_size])
+        if not batch:
+            return
+        yield batch
+        if len(batch) < batch_size:
+            return
+        last_pk = batch[-1].pk
+
+
+class BatchProgress:
+    """
+    Reports progress and throughput of batch processing to the given output.
+    """
+    def __init__(self, stdout, total, noun='items'):
+        self.stdout = stdout
+        self.total = total
+        self.noun = noun
+        self.done = 0
+        self.started_at = time.monotonic()
+
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started_at
+        return self.done / elapsed if elapsed else 0.0
+
+    def update(self, count):
+        self.done += count
+        self.stdout.write('Processed {}/{} {} ({:.1f}/s)'.format(self.done, self.total, self.noun, self.rate))
+
+    def finish(self):
+        self.stdout.write('Finished {} {} in {:.1f}s ({:.1f}/s)'
+                          .format(self.done, self.noun, time.monotonic() - self.started_at, self.rate))
+
+
+class BatchCommand(BaseCommand):
+    """
+    Base for the commands processing claims in batches, adds a `--batch-size` option.
+    """
+    default_batch_size = 100
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            dest='batch_size',
+            default=self.default_batch_size,
+            help='Number of objects processed at once, {} by default'.format(self.default_batch_size),
+        )
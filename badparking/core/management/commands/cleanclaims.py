@@ -1,15 +1,20 @@
+import time
+
 from datetime import timedelta
 
-from django.core.management.base import BaseCommand
 from django.utils import timezone
 
 from core.models import Claim
+from core.purge import purge_unauthorized_claims, delete_media_files
+from core.management.batching import BatchCommand, BatchProgress, iterate_batches
 
 
-class Command(BaseCommand):
+class Command(BatchCommand):
     help = 'Cleans up old unauthorized claims'
+    default_batch_size = 1000
 
     def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
         parser.add_argument('days_old', type=int)
         parser.add_argument(
             '--dry-run',
@@ -18,10 +23,32 @@ class Command(BaseCommand):
             default=False,
             help='Do not delete the claims',
         )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            dest='sleep',
+            default=0.1,
+            help='Seconds to pause between the batches to let other queries through',
+        )
 
     def handle(self, *args, **options):
         qs = Claim.objects.unauthorized().filter(created_at__lte=timezone.now() - timedelta(days=options['days_old']))
+        total = qs.count()
         self.stdout.write('Found {} unautorized claims older than {} days for the clean up'
-                          .format(qs.count(), options['days_old']))
-        if not options['dry_run']:
-            qs.delete()
+                          .format(total, options['days_old']))
+        if options['dry_run']:
+            return
+
+        # Purge in short transactions, so that only a bounded number of rows is locked at a time
+        progress = BatchProgress(self.stdout, total, 'claims')
+        deleted = files = 0
+        for batch in iterate_batches(qs.only('pk'), options['batch_size']):
+            count, filenames = purge_unauthorized_claims(c.pk for c in batch)
+            # Files go only after the rows are committed, so a failed purge never leaves media without files
+            files += delete_media_files(filenames)
+            deleted += count
+            progress.update(len(batch))
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        progress.finish()
+        self.stdout.write('Deleted {} claims and {} media files'.format(deleted, files))
@@ -1,15 +1,16 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
 
 from core.models import Claim
+from core.constants import CLAIM_TRANSITION_DONE
+from core.police import PoliceFeedbackClient, PoliceFeedbackError
+from core.management.batching import BatchCommand, BatchProgress, iterate_batches
 
 
-CLAIM_BATCH_SIZE = 100
-
-
-class Command(BaseCommand):
+class Command(BatchCommand):
     help = 'Scans for active claims and updates their states from the police feedback'
 
     def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
         parser.add_argument(
             '--dry-run',
             action='store_true',
@@ -19,23 +20,41 @@ class Command(BaseCommand):
         )
 
     def handle(self, *args, **options):
+        try:
+            police = PoliceFeedbackClient.from_settings()
+        except PoliceFeedbackError as exc:
+            raise CommandError(str(exc))
+
         qs = Claim.objects.authorized().active()
         total = qs.count()
         self.stdout.write('Querying {} claims'.format(total))
-        # Ask for feedback in batches to avoid overburdening the services
-        for start in range(0, total, CLAIM_BATCH_SIZE):
-            end = min(start + CLAIM_BATCH_SIZE, total)
-            claims = {c.pk: c for c in qs[start:end]}
-            for feedback in self._retrieve_feedback(map(lambda x: x.pk, claims)):
-                claim = claims.get(feedback['id'], None)
+        progress = BatchProgress(self.stdout, total, 'claims')
+        failed = 0
+        # Ask for feedback in batches to avoid overburdening the services, a few of them concurrently
+        batches = iterate_batches(qs, options['batch_size'])
+        for batch, feedback_list in police.retrieve_many(batches, ids=lambda batch: [c.pk for c in batch]):
+            progress.update(len(batch))
+            if feedback_list is None:
+                failed += len(batch)
+                continue
+
+            claims = {str(c.pk): c for c in batch}
+            changes = []
+            for feedback in feedback_list:
+                claim = claims.get(str(feedback['id']), None)
                 if claim and claim.status != feedback['status']:
-                    if not options['dry_run']:
-                        claim.log_state(status=feedback['status'], description=feedback.get('description', ''))
-                    self.stdout.write('{} changed status to {}'.format(str(claim), feedback['status']))
-
-    def _retrieve_feedback(self, claim_ids):
-        # TODO: retrieve and process actual feedback from the police interface when there are details
-        return [
-            {'id': 1, 'status': 'accepted'},
-            {'id': 2, 'status': 'in_progress', 'description': 'Police car #1111 was dispatched'}
-        ]
+                    changes.append((claim.pk, feedback['status'], feedback.get('description', '')))
+
+            if options['dry_run']:
+                outcomes = {claim_id: CLAIM_TRANSITION_DONE for claim_id, _, _ in changes}
+            else:
+                outcomes = qs.bulk_transition(changes)
+            for claim_id, status, _ in changes:
+                if outcomes[claim_id] == CLAIM_TRANSITION_DONE:
+                    self.stdout.write('{} changed status to {}'.format(str(claims[str(claim_id)]), status))
+                else:
+                    self.stdout.write('{} did not change status to {}: {}'
+                                      .format(str(claims[str(claim_id)]), status, outcomes[claim_id]))
+        progress.finish()
+        if failed:
+            self.stderr.write('Failed to retrieve feedback for {} claims'.format(failed))
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.10 on 2026-10-18 12:04
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_auto_20161022_0355'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='claim',
+            index_together=set([('modified_at', 'id')]),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.10 on 2026-10-18 13:21
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_claim_modified_at_index'),
+        ('media', '0002_auto_20160715_2035'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='claim',
+            name='crimetype_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list,
+                                                            editable=False, size=None),
+        ),
+        migrations.AddField(
+            model_name='claim',
+            name='uploaded_filenames',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), default=list,
+                                                            editable=False, size=None),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE core_claim SET
+                crimetype_ids = ARRAY(
+                    SELECT ct.crimetype_id FROM core_claim_crimetypes ct
+                    WHERE ct.claim_id = core_claim.id ORDER BY ct.crimetype_id),
+                uploaded_filenames = ARRAY(
+                    SELECT m.original_filename FROM core_claim_media cm
+                    JOIN media_mediafilemodel m ON m.id = cm.mediafilemodel_id
+                    WHERE cm.claim_id = core_claim.id ORDER BY m.id)
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX core_claim_crimetype_ids_gin ON core_claim USING gin (crimetype_ids)',
+            'DROP INDEX core_claim_crimetype_ids_gin',
+        ),
+    ]
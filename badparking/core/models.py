@@ -1,13 +1,21 @@
+import os
+
 from uuid import uuid4
 
-from django.db import models, transaction
+from django.db import models, transaction, connections
+from django.db.models import F, Func, Value, Case, When
+from django.db.models.sql.datastructures import EmptyResultSet
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.contrib.postgres.fields import ArrayField
+from django.utils import timezone
 
 from media.models import MediaFileModel
+from media.ingest import StagedFile
 
 from .constants import CLAIM_STATUS_CHOICES, CLAIM_STATUS_ENQUEUED, CLAIM_STATUS_CANCELED, CLAIM_STATUS_RECEIVED,\
-    CLAIM_STATUS_COMPLETE, CLAIM_ACTIVE_STATUSES
+    CLAIM_STATUS_COMPLETE, CLAIM_ACTIVE_STATUSES, CLAIM_CANCELABLE_STATUSES, CLAIM_STATUS_TRANSITIONS,\
+    CLAIM_TRANSITION_DONE, CLAIM_TRANSITION_UNCHANGED, CLAIM_TRANSITION_NOT_ALLOWED, CLAIM_TRANSITION_NOT_FOUND
 
 
 class CrimeType(models.Model):
@@ -31,6 +39,84 @@ class ClaimQuerySet(models.QuerySet):
     def enqueued(self):
         return self.filter(status=CLAIM_STATUS_ENQUEUED)
 
+    def with_related(self):
+        """
+        Fetches everything the claim serializers render in a constant number of queries regardless of the number
+        of claims.
+        """
+        return self.select_related('user').prefetch_related(
+            'crimetypes', 'media', models.Prefetch('states', queryset=ClaimState.objects.order_by('logged_at')))
+
+    def transition(self, status, description=''):
+        """
+        Moves claims of the queryset to `status` and logs the new state for those, which are in a status allowed
+        by `CLAIM_STATUS_TRANSITIONS`. Returns a list of primary keys of the transitioned claims.
+
+        The status is checked by the UPDATE itself instead of reading it first, so a claim changed concurrently is
+        transitioned only if it's still allowed to, and never twice.
+        """
+        if status not in CLAIM_STATUS_TRANSITIONS:
+            raise ValueError('Claims can not be transitioned to "{}"'.format(status))
+        sources = tuple(CLAIM_STATUS_TRANSITIONS[status])
+        try:
+            claims_sql, claims_params = self.filter(status__in=sources).order_by().values('pk').query.sql_with_params()
+        except EmptyResultSet:
+            return []
+        with transaction.atomic(using=self.db), connections[self.db].cursor() as cursor:
+            # Status condition is repeated outside of the subquery, as only that one is rechecked on a row, which
+            # was updated by a concurrent transaction
+            cursor.execute(
+                'UPDATE {table} SET status = %s, modified_at = %s WHERE {pk} IN ({claims}) AND status IN %s '
+                'RETURNING {pk}'.format(table=self.model._meta.db_table, pk=self.model._meta.pk.column,
+                                        claims=claims_sql),
+                (status, timezone.now()) + tuple(claims_params) + (sources,))
+            claim_ids = [row[0] for row in cursor.fetchall()]
+            ClaimState.objects.using(self.db).bulk_create(
+                ClaimState(claim_id=claim_id, status=status, description=description) for claim_id in claim_ids)
+        return claim_ids
+
+    def bulk_transition(self, changes):
+        """
+        Transitions a batch of claims of the queryset, each to its own status. `changes` is an iterable of
+        `(claim_id, status, description)` tuples.
+
+        Statuses are updated by a single UPDATE with a CASE over the claims and states are inserted in bulk.
+        Returns a dict of claim ID to one of `CLAIM_TRANSITION_*` outcomes.
+        """
+        changes = {claim_id: (status, description) for claim_id, status, description in changes}
+        if not changes:
+            return {}
+        outcomes = {claim_id: CLAIM_TRANSITION_NOT_FOUND for claim_id in changes}
+        # Outcomes are keyed by the given IDs, while the database returns them converted to the field type
+        given_ids = {}
+        for claim_id in changes:
+            try:
+                given_ids[self.model._meta.pk.to_python(str(claim_id))] = claim_id
+            except ValidationError:
+                pass
+        with transaction.atomic(using=self.db):
+            # Lock the batch, so that the statuses can't change between the check and the update
+            current = self.filter(pk__in=given_ids).select_for_update().order_by().values_list('pk', 'status')
+            allowed = {}
+            for pk, current_status in current:
+                claim_id = given_ids[pk]
+                status, description = changes[claim_id]
+                if current_status == status:
+                    outcomes[claim_id] = CLAIM_TRANSITION_UNCHANGED
+                elif current_status in CLAIM_STATUS_TRANSITIONS.get(status, ()):
+                    outcomes[claim_id] = CLAIM_TRANSITION_DONE
+                    allowed[pk] = (status, description)
+                else:
+                    outcomes[claim_id] = CLAIM_TRANSITION_NOT_ALLOWED
+            if allowed:
+                whens = [When(pk=pk, then=Value(status)) for pk, (status, _) in allowed.items()]
+                self.model.objects.filter(pk__in=allowed).update(
+                    status=Case(*whens, output_field=models.CharField()), modified_at=timezone.now())
+                ClaimState.objects.using(self.db).bulk_create(
+                    ClaimState(claim_id=pk, status=status, description=description)
+                    for pk, (status, description) in allowed.items())
+        return outcomes
+
 
 class Claim(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
@@ -51,6 +137,9 @@ class Claim(models.Model):
     crimetypes = models.ManyToManyField(CrimeType)
     media = models.ManyToManyField(MediaFileModel, blank=True)
     media_filenames = ArrayField(models.CharField(max_length=255), default=list)
+    # Denormalized `crimetypes` and `media` original filenames for single table filtering and completeness checks
+    crimetype_ids = ArrayField(models.IntegerField(), default=list, editable=False)
+    uploaded_filenames = ArrayField(models.CharField(max_length=255), default=list, editable=False)
     status = models.CharField(max_length=255, choices=CLAIM_STATUS_CHOICES, default=CLAIM_STATUS_RECEIVED,
                               db_index=True)
 
@@ -59,31 +148,81 @@ class Claim(models.Model):
     class Meta:
         permissions = (('can_list_all_claims', 'Can list all claims'),)
         ordering = ['-created_at']
+        index_together = [('modified_at', 'id')]  # Keyset scans of the changes feed
 
     def __str__(self):
         return '<Claim {} - {} - {}>'.format(self.pk, self.user.pk if self.user else 'Anonymous', self.status)
 
     def is_cancelable(self):
-        return self.status in (CLAIM_STATUS_RECEIVED, CLAIM_STATUS_COMPLETE)
+        return self.status in CLAIM_CANCELABLE_STATUSES
 
     def is_received(self):
         return self.status == CLAIM_STATUS_RECEIVED
 
     def try_cancel(self):
-        if self.is_cancelable():
-            self.log_state(CLAIM_STATUS_CANCELED)
+        """
+        Cancels the claim if it's still cancelable. Returns `True` on success.
+        """
+        return self.log_state(CLAIM_STATUS_CANCELED)
 
     def try_complete(self):
+        """
+        Marks the claim complete once the uploaded media matches the expected filenames. Returns `True` on success.
+
+        The filenames are compared by the same UPDATE that changes the status and sees appends by the concurrent
+        uploads, so the completion is logged exactly once.
+        """
         if not self.is_received():
-            return
-        if set(self.media.values_list('original_filename', flat=True)) == set(self.media_filenames):
-            self.log_state(CLAIM_STATUS_COMPLETE)
+            return False
+        claims = Claim.objects.filter(pk=self.pk,
+                                      uploaded_filenames__contains=F('media_filenames'),
+                                      media_filenames__contains=F('uploaded_filenames'))
+        return self._transition(claims, CLAIM_STATUS_COMPLETE)
 
     @transaction.atomic
+    def attach_media(self, media):
+        """
+        Adds `media` to the claim keeping `uploaded_filenames` in sync. The claim is marked modified for the changes
+        feed.
+        """
+        self.media.add(media)
+        self.modified_at = timezone.now()
+        Claim.objects.filter(pk=self.pk).update(uploaded_filenames=Func(
+            F('uploaded_filenames'), Value(media.original_filename), function='array_append',
+            output_field=ArrayField(models.CharField(max_length=255))), modified_at=self.modified_at)
+        self.uploaded_filenames.append(media.original_filename)
+
+    def sync_crimetype_ids(self):
+        """
+        Updates `crimetype_ids` from the `crimetypes` relation and marks the claim modified for the changes feed.
+        Called whenever the relation changes.
+        """
+        self.crimetype_ids = sorted(self.crimetypes.values_list('pk', flat=True))
+        self.modified_at = timezone.now()
+        Claim.objects.filter(pk=self.pk).update(crimetype_ids=self.crimetype_ids, modified_at=self.modified_at)
+
+    def sync_uploaded_filenames(self):
+        """
+        Updates `uploaded_filenames` from the `media` relation and marks the claim modified for the changes feed.
+        Called after the relation was edited other than by `attach_media`, e.g. in the admin.
+        """
+        self.uploaded_filenames = list(self.media.order_by('pk').values_list('original_filename', flat=True))
+        self.modified_at = timezone.now()
+        Claim.objects.filter(pk=self.pk).update(uploaded_filenames=self.uploaded_filenames,
+                                                modified_at=self.modified_at)
+
     def log_state(self, status, description=''):
-        self.states.create(status=status, description=description)
+        """
+        Moves the claim to `status` and logs it, if the transition is allowed from the current status in the
+        database, which may differ from the status of this instance. Returns `True` on success.
+        """
+        return self._transition(Claim.objects.filter(pk=self.pk), status, description)
+
+    def _transition(self, claims, status, description=''):
+        if not claims.transition(status, description):
+            return False
         self.status = status
-        self.save(update_fields=['status', 'modified_at'])
+        return True
 
 
 class ClaimState(models.Model):
@@ -94,3 +233,58 @@ class ClaimState(models.Model):
 
     def __str__(self):
         return '<ClaimState {} - {}>'.format(self.claim.pk, self.status)
+
+
+class ClaimMediaUpload(models.Model):
+    """
+    Media file being uploaded for a claim in byte ranges, which are written into a staging file by offset.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    claim = models.ForeignKey(Claim, related_name='uploads')
+    original_filename = models.CharField(max_length=255)
+    size = models.PositiveIntegerField()
+    offset = models.PositiveIntegerField(default=0, editable=False)
+    created_at = models.DateTimeField(editable=False, auto_now_add=True)
+
+    @property
+    def path(self):
+        return os.path.join(settings.MEDIA_UPLOAD_TEMP_DIR, '{}.part'.format(self.id))
+
+    @property
+    def is_finished(self):
+        return self.offset == self.size
+
+    def write_chunk(self, stream, start, length):
+        """
+        Copies `length` bytes from `stream` into the staging file at `start` without buffering them in memory,
+        then moves the offset. A range may overlap with the already received bytes, so that retries are harmless.
+        Raises `ValueError` if it doesn't continue the received bytes or the stream ends before `length`.
+        """
+        if start > self.offset or start + length > self.size:
+            raise ValueError('Range {}-{} does not continue the received {} bytes'
+                             .format(start, start + length - 1, self.offset))
+        os.makedirs(settings.MEDIA_UPLOAD_TEMP_DIR, exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o600)
+        with os.fdopen(fd, 'wb') as part:
+            part.seek(start)
+            remaining = length
+            while remaining:
+                chunk = stream.read(min(remaining, settings.MEDIA_UPLOAD_BUFFER_SIZE))
+                if not chunk:
+                    raise ValueError('Expected {} more bytes'.format(remaining))
+                part.write(chunk)
+                remaining -= len(chunk)
+        ClaimMediaUpload.objects.filter(pk=self.pk, offset__lt=start + length).update(offset=start + length)
+        self.offset = max(self.offset, start + length)
+
+    def open(self):
+        return StagedFile(self.path, self.original_filename)
+
+    def delete_file(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __str__(self):
+        return '<ClaimMediaUpload {} {}/{}>'.format(self.original_filename, self.offset, self.size)
@@ -0,0 +1,106 @@
+import time
+import logging
+
+from hashlib import sha256
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class PoliceFeedbackError(Exception):
+    pass
+
+
+class PoliceFeedbackClient(object):
+    """
+    Client of the police feedback interface.
+
+    Requests are signed the same way as requests of our API clients and sent over a pooled keep-alive session.
+    Idempotent requests failing on connection or with a server error are retried with exponential backoff.
+    Optionally following keyword arguments may be provided:
+        timeout: seconds to wait for a connection and then for a response of each request
+        max_workers: number of batches requested concurrently by `retrieve_many`
+        retries: number of retries of each request
+        backoff_factor: base of the exponential delay between the retries
+    """
+
+    feedback_endpoint = 'api/v1/feedback'
+
+    def __init__(self, url, client_id, client_secret, timeout=10, max_workers=4, retries=3, backoff_factor=0.5):
+        self.url = url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.timeout = timeout
+        self.max_workers = max_workers
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=Retry(
+            total=retries, backoff_factor=backoff_factor, status_forcelist=(500, 502, 503, 504),
+            method_whitelist=frozenset(['GET'])))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @classmethod
+    def from_settings(cls):
+        options = dict(settings.POLICE_FEEDBACK)
+        if not options.get('url'):
+            raise PoliceFeedbackError('Police feedback interface is not configured')
+        return cls(**options)
+
+    def retrieve(self, claim_ids):
+        """
+        Returns a list of feedback dicts with `id`, `status` and optional `description` for the given claims.
+        Raises `PoliceFeedbackError` if the feedback could not be retrieved.
+        """
+        params = self._auth_params()
+        params['id'] = [str(claim_id) for claim_id in claim_ids]
+        try:
+            response = self.session.get(urljoin(self.url, self.feedback_endpoint), params=params,
+                                        headers={'Accept': 'application/json'}, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, ValueError) as exc:
+            raise PoliceFeedbackError('Retrieving feedback failed: {}'.format(exc))
+
+    def retrieve_many(self, batches, ids=lambda batch: batch):
+        """
+        Retrieves feedback for each of `batches` concurrently and yields `(batch, feedback)` pairs in the order of
+        completion. `ids` maps a batch to its claim IDs. Feedback of a failed batch is `None`.
+
+        Batches are consumed lazily, at most twice as many as there are workers are in flight at a time.
+        """
+        batches = iter(batches)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {}
+            while True:
+                for batch in batches:
+                    pending[executor.submit(self.retrieve, ids(batch))] = batch
+                    if len(pending) >= self.max_workers * 2:
+                        break
+                if not pending:
+                    return
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = pending.pop(future)
+                    try:
+                        feedback = future.result()
+                    except PoliceFeedbackError:
+                        logger.exception('Retrieving police feedback for a batch of claims failed')
+                        feedback = None
+                    yield batch, feedback
+
+    def _auth_params(self):
+        timestamp = str(int(time.time()))
+        return {
+            'client_id': self.client_id,
+            'client_secret': sha256(self.client_secret.encode('utf8') + timestamp.encode('utf8')).hexdigest(),
+            'timestamp': timestamp
+        }
@@ -0,0 +1,61 @@
+from django.db import connection, transaction
+
+from media.models import MediaFileModel
+
+from .models import Claim, ClaimState
+
+
+def purge_unauthorized_claims(claim_ids):
+    """
+    Deletes unauthorized claims by `claim_ids` together with their states, relations and media, which is not used
+    by any other claim. Files still shared by other media are kept. Claims authorized in the meantime are left alone.
+
+    Rows are deleted by a few plain DELETE statements instead of Django's collector, which would load every
+    related object into memory first. Returns a tuple of the number of deleted claims and a list of names of
+    the media files to be removed from the storage by `delete_media_files` once the transaction is committed.
+    """
+    claim_ids = tuple(claim_ids)
+    if not claim_ids:
+        return 0, []
+
+    crimetypes_table = Claim.crimetypes.through._meta.db_table
+    media_table = Claim.media.through._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Foreign keys are checked on commit, so the claims can go first and lock the rows being purged
+        cursor.execute('DELETE FROM {} WHERE id IN %s AND user_id IS NULL RETURNING id'
+                       .format(Claim._meta.db_table), [claim_ids])
+        claim_ids = tuple(row[0] for row in cursor.fetchall())
+        if not claim_ids:
+            return 0, []
+
+        cursor.execute('DELETE FROM {} WHERE claim_id IN %s'.format(ClaimState._meta.db_table), [claim_ids])
+        cursor.execute('DELETE FROM {} WHERE claim_id IN %s'.format(crimetypes_table), [claim_ids])
+        cursor.execute('DELETE FROM {} WHERE claim_id IN %s RETURNING mediafilemodel_id'.format(media_table),
+                       [claim_ids])
+        media_ids = tuple(row[0] for row in cursor.fetchall())
+
+        filenames = []
+        if media_ids:
+            cursor.execute(
+                'DELETE FROM {media} WHERE id IN %s AND NOT EXISTS ('
+                '    SELECT 1 FROM {claim_media} WHERE mediafilemodel_id = {media}.id'
+                ') RETURNING file'.format(media=MediaFileModel._meta.db_table, claim_media=media_table),
+                [media_ids])
+            filenames = [row[0] for row in cursor.fetchall()]
+        if filenames:
+            # Media with the same content share a single file
+            shared = set(MediaFileModel.objects.filter(file__in=filenames).values_list('file', flat=True))
+            filenames = [filename for filename in set(filenames) if filename not in shared]
+    return len(claim_ids), filenames
+
+
+def delete_media_files(filenames):
+    """
+    Deletes the media files and their thumbnails from the storage, except those new media were deduplicated onto
+    since they were purged. Returns the number of deleted files.
+    """
+    reused = set(MediaFileModel.objects.filter(file__in=filenames).values_list('file', flat=True))
+    filenames = [filename for filename in filenames if filename not in reused]
+    for filename in filenames:
+        MediaFileModel(file=filename).delete_files()
+    return len(filenames)
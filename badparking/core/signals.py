@@ -0,0 +1,20 @@
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from .models import Claim
+
+
+@receiver(m2m_changed, sender=Claim.crimetypes.through)
+def claim_crimetypes_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        instance.sync_crimetype_ids()
+        return
+    # Crime type side of the relation, `pk_set` holds the affected claims unless it was cleared
+    if pk_set is None:
+        claims = Claim.objects.filter(crimetype_ids__contains=[instance.pk])
+    else:
+        claims = Claim.objects.filter(pk__in=pk_set)
+    for claim in claims.only('pk'):
+        claim.sync_crimetype_ids()
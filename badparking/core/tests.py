@@ -1,3 +1,368 @@
-from django.test import TestCase
+import json
 
-# Create your tests here.
+from io import StringIO
+from datetime import timedelta
+from unittest.mock import patch
+from threading import Thread
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from django.db import connection
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test.utils import CaptureQueriesContext
+from django.db.models import F
+
+from media.models import MediaFileModel
+
+from .models import CrimeType, Claim
+from .purge import purge_unauthorized_claims, delete_media_files
+from .police import PoliceFeedbackClient
+from .management.batching import iterate_batches
+from .constants import CLAIM_STATUS_RECEIVED, CLAIM_STATUS_COMPLETE, CLAIM_STATUS_ENQUEUED, CLAIM_STATUS_ACCEPTED,\
+    CLAIM_STATUS_RESOLVED, CLAIM_STATUS_IN_PROGRESS, CLAIM_TRANSITION_DONE, CLAIM_TRANSITION_UNCHANGED,\
+    CLAIM_TRANSITION_NOT_ALLOWED, CLAIM_TRANSITION_NOT_FOUND
+
+
+class ClaimTestCase(TestCase):
+    def _create_claim(self, **kwargs):
+        data = {
+            'license_plates': 'АА1111АБ',
+            'longitude': '30.379921',
+            'latitude': '50.377243',
+            'city': 'Київ',
+            'address': 'вул. Жулянська, 1',
+        }
+        data.update(kwargs)
+        return Claim.objects.create(**data)
+
+    def _create_media(self, original_filename):
+        # Only the name is stored, the file itself is not needed unless accessed
+        return MediaFileModel.objects.create(file='images/{}'.format(original_filename),
+                                             original_filename=original_filename)
+
+
+class ClaimDenormalizationTests(ClaimTestCase):
+    def test_crimetype_ids(self):
+        first, second = (CrimeType.objects.create(name=name, enabled=True) for name in ('First', 'Second'))
+        claim = self._create_claim()
+
+        claim.crimetypes.add(second, first)
+        self.assertEqual(Claim.objects.get(pk=claim.pk).crimetype_ids, sorted([first.pk, second.pk]))
+
+        claim.crimetypes.remove(first)
+        self.assertEqual(Claim.objects.get(pk=claim.pk).crimetype_ids, [second.pk])
+
+        # Changes from the other side of the relation
+        first.claim_set.add(claim)
+        self.assertEqual(Claim.objects.get(pk=claim.pk).crimetype_ids, sorted([first.pk, second.pk]))
+        second.claim_set.clear()
+        self.assertEqual(Claim.objects.get(pk=claim.pk).crimetype_ids, [first.pk])
+
+        self.assertEqual(list(Claim.objects.filter(crimetype_ids__overlap=[first.pk])), [claim])
+
+    def test_uploaded_filenames(self):
+        claim = self._create_claim(media_filenames=['1.jpg', '2.jpg'])
+        claim.attach_media(self._create_media('1.jpg'))
+        claim.try_complete()
+        self.assertEqual(Claim.objects.get(pk=claim.pk).uploaded_filenames, ['1.jpg'])
+        self.assertEqual(claim.status, CLAIM_STATUS_RECEIVED)
+
+        claim.attach_media(self._create_media('2.jpg'))
+        claim.try_complete()
+        claim = Claim.objects.get(pk=claim.pk)
+        self.assertEqual(claim.uploaded_filenames, ['1.jpg', '2.jpg'])
+        self.assertEqual(claim.status, CLAIM_STATUS_COMPLETE)
+        self.assertEqual(claim.media.count(), 2)
+
+    def test_sync_uploaded_filenames(self):
+        claim = self._create_claim(media_filenames=['1.jpg', '2.jpg'])
+        claim.attach_media(self._create_media('1.jpg'))
+        # Edited through the relation as the admin does
+        claim.media.clear()
+        claim.media.add(self._create_media('2.jpg'))
+        claim.sync_uploaded_filenames()
+        self.assertEqual(Claim.objects.get(pk=claim.pk).uploaded_filenames, ['2.jpg'])
+
+
+class ClaimCompletionTests(ClaimTestCase):
+    def test_upload_cost_does_not_grow(self):
+        filenames = ['{}.jpg'.format(i) for i in range(5)]
+        claim = self._create_claim(media_filenames=filenames)
+        counts = []
+        for filename in filenames:
+            media = self._create_media(filename)
+            with CaptureQueriesContext(connection) as context:
+                claim.attach_media(media)
+                claim.try_complete()
+            counts.append(len(context.captured_queries))
+            self.assertFalse(any('media_mediafilemodel' in q['sql'] for q in context.captured_queries))
+
+        # Last upload completes the claim and logs its state
+        self.assertEqual(len(set(counts[:-1])), 1)
+        self.assertEqual(claim.status, CLAIM_STATUS_COMPLETE)
+        self.assertEqual(list(claim.states.values_list('status', flat=True)), [CLAIM_STATUS_COMPLETE])
+
+    def test_stale_instance_does_not_complete_twice(self):
+        claim = self._create_claim(media_filenames=['1.jpg'])
+        stale = Claim.objects.get(pk=claim.pk)
+        claim.attach_media(self._create_media('1.jpg'))
+        claim.try_complete()
+        stale.uploaded_filenames = ['1.jpg']
+        stale.try_complete()
+        self.assertEqual(claim.states.count(), 1)
+
+    def test_extra_upload_blocks_completion(self):
+        claim = self._create_claim(media_filenames=['1.jpg'])
+        claim.attach_media(self._create_media('2.jpg'))
+        claim.attach_media(self._create_media('1.jpg'))
+        claim.try_complete()
+        self.assertEqual(Claim.objects.get(pk=claim.pk).status, CLAIM_STATUS_RECEIVED)
+
+
+class ClaimTransitionTests(ClaimTestCase):
+    def test_log_state(self):
+        claim = self._create_claim(status=CLAIM_STATUS_COMPLETE)
+        self.assertTrue(claim.log_state(CLAIM_STATUS_ENQUEUED))
+        self.assertFalse(claim.log_state(CLAIM_STATUS_COMPLETE))
+        self.assertTrue(claim.log_state(CLAIM_STATUS_ACCEPTED, 'Accepted'))
+
+        claim = Claim.objects.get(pk=claim.pk)
+        self.assertEqual(claim.status, CLAIM_STATUS_ACCEPTED)
+        self.assertEqual(list(claim.states.order_by('logged_at').values_list('status', 'description')),
+                         [(CLAIM_STATUS_ENQUEUED, ''), (CLAIM_STATUS_ACCEPTED, 'Accepted')])
+
+    def test_stale_instance(self):
+        claim = self._create_claim()
+        stale = Claim.objects.get(pk=claim.pk)
+        self.assertTrue(claim.try_cancel())
+        # Still looks received, but the database knows better
+        self.assertTrue(stale.is_cancelable())
+        self.assertFalse(stale.try_cancel())
+        self.assertFalse(stale.log_state(CLAIM_STATUS_COMPLETE))
+        self.assertEqual(claim.states.count(), 1)
+
+    def test_bulk_transition(self):
+        enqueued = [self._create_claim(status=CLAIM_STATUS_ENQUEUED) for _ in range(3)]
+        received = self._create_claim()
+        claim_ids = Claim.objects.all().transition(CLAIM_STATUS_RESOLVED, 'Done')
+        self.assertEqual(set(claim_ids), {c.pk for c in enqueued})
+        self.assertEqual(Claim.objects.filter(status=CLAIM_STATUS_RESOLVED).count(), 3)
+        self.assertEqual(received.states.count(), 0)
+        self.assertEqual(Claim.objects.none().transition(CLAIM_STATUS_RESOLVED), [])
+
+    def test_unknown_target(self):
+        with self.assertRaises(ValueError):
+            Claim.objects.all().transition(CLAIM_STATUS_RECEIVED)
+
+    def test_bulk_transition_outcomes(self):
+        accepted, resolved, enqueued, other = (
+            self._create_claim(status=status)
+            for status in (CLAIM_STATUS_ENQUEUED, CLAIM_STATUS_RESOLVED, CLAIM_STATUS_ENQUEUED, CLAIM_STATUS_ENQUEUED))
+        with CaptureQueriesContext(connection) as context:
+            outcomes = Claim.objects.exclude(pk=other.pk).bulk_transition([
+                (accepted.pk, CLAIM_STATUS_ACCEPTED, ''),
+                (str(enqueued.pk), CLAIM_STATUS_IN_PROGRESS, 'Police car #1111 was dispatched'),
+                (resolved.pk, CLAIM_STATUS_IN_PROGRESS, ''),
+                (other.pk, CLAIM_STATUS_ACCEPTED, ''),
+                ('garbage', CLAIM_STATUS_ACCEPTED, ''),
+            ])
+        self.assertEqual(outcomes, {
+            accepted.pk: CLAIM_TRANSITION_DONE,
+            str(enqueued.pk): CLAIM_TRANSITION_DONE,
+            resolved.pk: CLAIM_TRANSITION_NOT_ALLOWED,
+            other.pk: CLAIM_TRANSITION_NOT_FOUND,
+            'garbage': CLAIM_TRANSITION_NOT_FOUND,
+        })
+        statements = [q['sql'].split(' ', 1)[0] for q in context.captured_queries]
+        self.assertEqual(statements.count('UPDATE'), 1)
+        self.assertEqual(statements.count('INSERT'), 1)
+        self.assertEqual(Claim.objects.get(pk=accepted.pk).status, CLAIM_STATUS_ACCEPTED)
+        self.assertEqual(Claim.objects.get(pk=enqueued.pk).status, CLAIM_STATUS_IN_PROGRESS)
+        self.assertEqual(enqueued.states.get().description, 'Police car #1111 was dispatched')
+        self.assertEqual(Claim.objects.get(pk=resolved.pk).status, CLAIM_STATUS_RESOLVED)
+
+        outcomes = Claim.objects.bulk_transition([(accepted.pk, CLAIM_STATUS_ACCEPTED, '')])
+        self.assertEqual(outcomes, {accepted.pk: CLAIM_TRANSITION_UNCHANGED})
+
+
+class BatchingTests(ClaimTestCase):
+    def test_rows_leaving_queryset(self):
+        claims = [self._create_claim(status=CLAIM_STATUS_ENQUEUED) for _ in range(7)]
+        qs = Claim.objects.filter(status=CLAIM_STATUS_ENQUEUED)
+        seen = []
+        for batch in iterate_batches(qs, 3):
+            self.assertLessEqual(len(batch), 3)
+            seen.extend(c.pk for c in batch)
+            # Processed claims drop out of the queryset, which would make OFFSET skip the following ones
+            qs.filter(pk__in=[c.pk for c in batch]).update(status=CLAIM_STATUS_ACCEPTED)
+        self.assertEqual(seen, sorted(c.pk for c in claims))
+
+    def test_cleanclaims(self):
+        old = [self._create_claim() for _ in range(5)]
+        Claim.objects.filter(pk__in=[c.pk for c in old]).update(created_at=F('created_at') - timedelta(days=10))
+        fresh = self._create_claim()
+        out = StringIO()
+        call_command('cleanclaims', '7', batch_size=2, stdout=out)
+        self.assertEqual(list(Claim.objects.all()), [fresh])
+        self.assertIn('Finished 5 claims', out.getvalue())
+
+
+class PurgeTests(ClaimTestCase):
+    def test_purge_unauthorized_claims(self):
+        user = get_user_model().objects.create(username='purge')
+        own, shared = self._create_media('own.jpg'), self._create_media('shared.jpg')
+        crimetype = CrimeType.objects.create(name='Purged', enabled=True)
+        claim = self._create_claim()
+        claim.media.add(own, shared)
+        claim.crimetypes.add(crimetype)
+        claim.log_state(CLAIM_STATUS_COMPLETE)
+        authorized = self._create_claim(user=user)
+        authorized.media.add(shared)
+
+        count, filenames = purge_unauthorized_claims([claim.pk, authorized.pk])
+        self.assertEqual(count, 1)
+        self.assertEqual(filenames, [own.file.name])
+        self.assertEqual(list(Claim.objects.all()), [authorized])
+        self.assertEqual(list(MediaFileModel.objects.all()), [shared])
+        self.assertEqual(list(authorized.media.all()), [shared])
+        self.assertFalse(Claim.crimetypes.through.objects.filter(claim_id=claim.pk).exists())
+
+    def test_shared_files_are_kept(self):
+        first, second = self._create_media('photo.jpg'), self._create_media('photo.jpg')
+        claim, other = self._create_claim(), self._create_claim()
+        claim.media.add(first)
+        other.media.add(second)
+
+        count, filenames = purge_unauthorized_claims([claim.pk])
+        self.assertEqual(count, 1)
+        self.assertEqual(filenames, [])
+        self.assertEqual(list(MediaFileModel.objects.all()), [second])
+
+    def test_nothing_to_purge(self):
+        self.assertEqual(purge_unauthorized_claims([]), (0, []))
+
+    def test_reused_files_are_not_deleted(self):
+        claim = self._create_claim()
+        claim.media.add(self._create_media('photo.jpg'))
+        count, filenames = purge_unauthorized_claims([claim.pk])
+        self.assertEqual(filenames, ['images/photo.jpg'])
+
+        # Deduplicated onto the file after the purge was committed
+        self._create_media('photo.jpg')
+        with patch.object(MediaFileModel, 'delete_files') as delete_files:
+            self.assertEqual(delete_media_files(filenames + ['images/orphan.jpg']), 1)
+        self.assertEqual(delete_files.call_count, 1)
+
+
+class FakePoliceServer(ThreadingMixIn, HTTPServer):
+    """
+    Local stand-in for the police feedback interface.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super(FakePoliceServer, self).__init__(('127.0.0.1', 0), FakePoliceHandler)
+        self.feedback = {}  # Claim ID to feedback dict
+        self.failures = 0  # Number of requests to fail before responding
+        self.requests = []
+
+    @property
+    def url(self):
+        return 'http://{}:{}/'.format(*self.server_address)
+
+
+class FakePoliceHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        self.server.requests.append(query)
+        if self.server.failures:
+            self.server.failures -= 1
+            self.send_response(503)
+            self.end_headers()
+            return
+        if url.path != '/api/v1/feedback' or not query.get('client_secret'):
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = json.dumps([self.server.feedback[i] for i in query.get('id', []) if i in self.server.feedback])
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body.encode('utf8'))
+
+    def log_message(self, *args):
+        pass
+
+
+class PoliceServerMixin:
+    @classmethod
+    def setUpClass(cls):
+        super(PoliceServerMixin, cls).setUpClass()
+        cls.police = FakePoliceServer()
+        Thread(target=cls.police.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.police.shutdown()
+        cls.police.server_close()
+        super(PoliceServerMixin, cls).tearDownClass()
+
+    def setUp(self):
+        self.police.feedback = {}
+        self.police.failures = 0
+        self.police.requests = []
+
+
+class PoliceFeedbackClientTests(PoliceServerMixin, SimpleTestCase):
+    def _client(self, **kwargs):
+        kwargs.setdefault('backoff_factor', 0)
+        return PoliceFeedbackClient(self.police.url, 'client', 'secret', **kwargs)
+
+    def test_retrieve(self):
+        self.police.feedback = {'1': {'id': '1', 'status': CLAIM_STATUS_ACCEPTED}}
+        self.assertEqual(self._client().retrieve(['1', '2']), [{'id': '1', 'status': CLAIM_STATUS_ACCEPTED}])
+        self.assertEqual(self.police.requests[0]['id'], ['1', '2'])
+        self.assertEqual(self.police.requests[0]['client_id'], ['client'])
+
+    def test_retry(self):
+        self.police.failures = 2
+        self.assertEqual(self._client(retries=2).retrieve(['1']), [])
+        self.assertEqual(len(self.police.requests), 3)
+
+    def test_retrieve_many(self):
+        self.police.feedback = {str(i): {'id': str(i), 'status': CLAIM_STATUS_ACCEPTED} for i in range(10)}
+        batches = [[str(i), str(i + 1)] for i in range(0, 10, 2)]
+        results = list(self._client(max_workers=2).retrieve_many(batches))
+        self.assertEqual(sorted(batch for batch, _ in results), batches)
+        for batch, feedback in results:
+            self.assertEqual([f['id'] for f in feedback], batch)
+
+    def test_failed_batch(self):
+        self.police.failures = 10
+        results = list(self._client(retries=1).retrieve_many([['1']]))
+        self.assertEqual(results, [(['1'], None)])
+
+
+class FeedbackCommandTests(PoliceServerMixin, ClaimTestCase):
+    def test_feedback(self):
+        user = get_user_model().objects.create(username='reporter')
+        claims = [self._create_claim(user=user, status=CLAIM_STATUS_ENQUEUED) for _ in range(5)]
+        self.police.feedback = {
+            str(claims[0].pk): {'id': str(claims[0].pk), 'status': CLAIM_STATUS_ACCEPTED},
+            str(claims[3].pk): {'id': str(claims[3].pk), 'status': CLAIM_STATUS_IN_PROGRESS,
+                                'description': 'Police car #1111 was dispatched'},
+        }
+        police_settings = {'url': self.police.url, 'client_id': 'client', 'client_secret': 'secret'}
+        with override_settings(POLICE_FEEDBACK=police_settings):
+            call_command('feedback', batch_size=2, stdout=StringIO())
+
+        self.assertEqual(len(self.police.requests), 3)
+        statuses = dict(Claim.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[claims[0].pk], CLAIM_STATUS_ACCEPTED)
+        self.assertEqual(statuses[claims[3].pk], CLAIM_STATUS_IN_PROGRESS)
+        self.assertEqual(statuses[claims[1].pk], CLAIM_STATUS_ENQUEUED)
+        self.assertEqual(claims[3].states.get().description, 'Police car #1111 was dispatched')
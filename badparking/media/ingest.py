@@ -0,0 +1,102 @@
+from io import BytesIO
+from hashlib import sha256
+from pathlib import Path
+
+from PIL import Image
+from django.core.files.base import File, ContentFile
+
+
+EXIF_ORIENTATION_TAG = 274
+
+# Transpositions bringing an image with the given EXIF orientation upright
+ORIENTATION_TRANSPOSES = {
+    2: (Image.FLIP_LEFT_RIGHT,),
+    3: (Image.ROTATE_180,),
+    4: (Image.FLIP_TOP_BOTTOM,),
+    5: (Image.TRANSPOSE,),
+    6: (Image.ROTATE_270,),
+    7: (Image.ROTATE_90, Image.FLIP_LEFT_RIGHT),
+    8: (Image.ROTATE_90,),
+}
+
+
+def get_orientation(image):
+    try:
+        exif = image._getexif() or {}
+    except (AttributeError, IndexError, KeyError, SyntaxError, ValueError):
+        # No or broken EXIF
+        return 1
+    return exif.get(EXIF_ORIENTATION_TAG, 1)
+
+
+def file_digest(file):
+    """
+    Returns the hex SHA-256 digest of `file` read in chunks.
+    """
+    digest = sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def image_info(file):
+    """
+    Returns width, height and MIME type of the image `file`, reading only its header. All are empty if `file` is
+    not an image.
+    """
+    file.seek(0)
+    try:
+        image = Image.open(file)
+        return image.size + (Image.MIME.get(image.format, ''),)
+    except (IOError, SyntaxError):
+        return None, None, ''
+    finally:
+        file.seek(0)
+
+
+def normalize_image(file, max_dimension=None, quality=85):
+    """
+    Returns a JPEG `ContentFile` of the image `file` turned upright according to its EXIF orientation, stripped of
+    all the metadata and downscaled to fit `max_dimension` if given. Returns `None` if `file` is not an image.
+
+    JPEGs are decoded at the smallest DCT scale still larger than the target size, which is several times faster
+    than decoding the full resolution of a phone camera photo.
+    """
+    file.seek(0)
+    try:
+        image = Image.open(file)
+        orientation = get_orientation(image)
+        if max_dimension:
+            ratio = max_dimension / max(image.size)
+            if ratio < 1:
+                image.draft('RGB', (int(image.size[0] * ratio), int(image.size[1] * ratio)))
+        image.load()
+    except (IOError, SyntaxError):
+        return None
+    finally:
+        file.seek(0)
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    if max_dimension:
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    for method in ORIENTATION_TRANSPOSES.get(orientation, ()):
+        image = image.transpose(method)
+
+    # Metadata is only written when passed explicitly, so saving a fresh image strips EXIF including the location
+    content = BytesIO()
+    image.save(content, 'JPEG', quality=quality, optimize=True)
+    return ContentFile(content.getvalue(), name='{}.jpg'.format(Path(file.name).stem))
+
+
+class StagedFile(File):
+    """
+    File assembled on the local disk before it's stored. The storage moves it into place instead of copying.
+    """
+    def __init__(self, path, name):
+        super(StagedFile, self).__init__(open(path, 'rb'), name)
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
@@ -0,0 +1,121 @@
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils import timezone
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from media.models import MediaFileModel
+from media.utils import BloomFilter
+
+
+class Command(BaseCommand):
+    help = 'Deletes media files and thumbnails, which are not referenced by any media object'
+
+    # Directories of the storage holding uploaded files and generated thumbnails
+    scan_dirs = ('images', settings.IMAGEKIT_CACHEFILE_DIR)
+    chunk_size = 1000
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help='Only list the orphaned files',
+        )
+        parser.add_argument(
+            '--grace-period',
+            type=int,
+            dest='grace_period',
+            default=24,
+            help='Hours since the last modification during which a file is never deleted, 24 by default',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            dest='workers',
+            default=8,
+            help='Number of files deleted concurrently, 8 by default',
+        )
+
+    def handle(self, *args, **options):
+        started_at = time.monotonic()
+        self.scan_started_at = timezone.now()
+        referenced = self.referenced_files()
+        # Files of uploads in progress may be saved before their objects are committed
+        modified_before = time.time() - options['grace_period'] * 3600
+
+        scanned = orphaned = 0
+        pending = []
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for name, mtime in self.scan_storage():
+                scanned += 1
+                # Bloom filter may only mistake an orphan for a referenced file, never the other way round
+                if name in referenced or mtime > modified_before:
+                    continue
+                orphaned += 1
+                if options['dry_run']:
+                    self.stdout.write(name)
+                    continue
+                pending.append(name)
+                # Deleted in chunks, so that the queue doesn't grow with the number of orphans
+                if len(pending) >= self.chunk_size:
+                    orphaned -= self.delete_chunk(executor, pending)
+                    pending = []
+            if pending:
+                orphaned -= self.delete_chunk(executor, pending)
+
+        self.stdout.write('Scanned {} files, {} {} orphaned in {:.1f}s'.format(
+            scanned, orphaned, 'found' if options['dry_run'] else 'deleted', time.monotonic() - started_at))
+
+    def referenced_files(self):
+        referenced = BloomFilter(MediaFileModel.objects.count() * 2)
+        for media in MediaFileModel.objects.only('file').iterator():
+            referenced.add(media.file.name)
+            referenced.add(media.thumbnail.name)
+        return referenced
+
+    def scan_storage(self):
+        """
+        Yields names and modification times of all the files in `scan_dirs`, walking the directory tree lazily.
+        """
+        if hasattr(default_storage, 'scan'):
+            # Object storage lists the files by pages itself
+            for directory in self.scan_dirs:
+                yield from default_storage.scan(directory)
+            return
+
+        root = default_storage.path('')
+        stack = [default_storage.path(directory) for directory in self.scan_dirs]
+        while stack:
+            try:
+                entries = os.scandir(stack.pop())
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    name = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                    yield name, entry.stat(follow_symlinks=False).st_mtime
+
+    def delete_chunk(self, executor, names):
+        """
+        Deletes the files `names` except those referenced since the scan started, as uploads deduplicated onto
+        an existing file don't refresh it. Returns the number of files kept.
+        """
+        referenced = set(MediaFileModel.objects.filter(file__in=names).values_list('file', flat=True))
+        for media in MediaFileModel.objects.filter(created_at__gte=self.scan_started_at).only('file'):
+            referenced.add(media.thumbnail.name)
+        list(executor.map(self.delete, [name for name in names if name not in referenced]))
+        return sum(name in referenced for name in names)
+
+    def delete(self, name):
+        try:
+            default_storage.delete(name)
+        except OSError as exc:
+            self.stderr.write('Deleting {} failed: {}'.format(name, exc))
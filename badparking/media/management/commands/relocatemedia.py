@@ -0,0 +1,159 @@
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db.models import Case, When, Value, F
+from django.core.files.storage import default_storage
+from imagekit.utils import get_by_qname
+
+from core.management.batching import BatchCommand, BatchProgress, iterate_batches
+from media.models import MediaFileModel, generate_upload_path
+from media.ingest import file_digest, image_info
+
+
+class Command(BatchCommand):
+    help = 'Moves media files and thumbnails into the current sharded layout and fills in missing metadata'
+    default_batch_size = 500
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--workers',
+            type=int,
+            dest='workers',
+            default=8,
+            help='Number of files moved concurrently, 8 by default',
+        )
+        parser.add_argument(
+            '--old-thumbnail-namer',
+            dest='old_thumbnail_namer',
+            default='imagekit.cachefiles.namers.hash',
+            help='Imagekit namer the existing thumbnails were named by',
+        )
+
+    def handle(self, *args, **options):
+        self.old_thumbnail_namer = get_by_qname(options['old_thumbnail_namer'], 'namer')
+        qs = MediaFileModel.objects.only('file', 'digest', 'file_size')
+        progress = BatchProgress(self.stdout, qs.count(), 'media')
+        moved = failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for batch in iterate_batches(qs, options['batch_size']):
+                # Media with the same digest share the file, it's moved once for all of them
+                by_name = {}
+                for media in batch:
+                    by_name.setdefault(media.file.name, []).append(media)
+
+                # Digests of media uploaded before deduplication are stored before any file is moved, so that
+                # their new names are known to a rerun of an interrupted one. Size and dimensions of media uploaded
+                # before they were stored are filled in at the same time.
+                incomplete = [g[0] for g in by_name.values() if not g[0].digest or g[0].file_size is None]
+                inspected = {}
+                for media, values in zip(incomplete, executor.map(self.inspect, incomplete)):
+                    if values is None:
+                        failed += len(by_name.pop(media.file.name))
+                    else:
+                        inspected[media.file.name] = values
+                        for item in by_name[media.file.name]:
+                            item.digest = values.get('digest', item.digest)
+                self.update(by_name, inspected)
+
+                relocated = {}
+                for name, new_name in zip(by_name, executor.map(self.relocate, [g[0] for g in by_name.values()])):
+                    if new_name is None:
+                        failed += len(by_name[name])
+                    elif new_name != name:
+                        relocated[name] = new_name
+                moved += self.rename(relocated)
+                progress.update(len(batch))
+        progress.finish()
+        self.stdout.write('Relocated {} media, {} failed'.format(moved, failed))
+
+    def update(self, by_name, values):
+        """
+        Sets the fields of the media grouped `by_name` to the dicts of values by file name in a single UPDATE.
+        """
+        if not values:
+            return
+        fields = {field for field_values in values.values() for field in field_values}
+        pks = [media.pk for name in values for media in by_name[name]]
+        MediaFileModel.objects.filter(pk__in=pks).update(**{field: Case(
+            *[When(pk=media.pk, then=Value(field_values[field]))
+              for name, field_values in values.items() if field in field_values for media in by_name[name]],
+            default=F(field), output_field=MediaFileModel._meta.get_field(field)) for field in fields})
+
+    def rename(self, renamed):
+        """
+        Points all the media with the old file names at the new ones in a single UPDATE and returns their number.
+        Media are matched by the file name, not by the batch, to include uploads deduplicated onto a file while it
+        was being moved.
+        """
+        if not renamed:
+            return 0
+        return MediaFileModel.objects.filter(file__in=list(renamed)).update(file=Case(
+            *[When(file=name, then=Value(new_name)) for name, new_name in renamed.items()],
+            output_field=MediaFileModel._meta.get_field('file')))
+
+    def inspect(self, media):
+        """
+        Returns a dict of the missing digest and metadata of `media` read from its file, or `None` on failure.
+        """
+        values = {}
+        try:
+            with default_storage.open(media.file.name) as file:
+                if not media.digest:
+                    values['digest'] = file_digest(file)
+                if media.file_size is None:
+                    values['file_size'] = default_storage.size(media.file.name)
+                    values['width'], values['height'], values['mime_type'] = image_info(file)
+        except (OSError, NotImplementedError) as exc:
+            self.stderr.write('Reading {} failed: {}'.format(media.file.name, exc))
+            return None
+        return values
+
+    def relocate(self, media):
+        """
+        Moves the thumbnail and then the file of `media` with a digest to the names of the current layout and
+        returns the new file name. Returns `None` on failure.
+
+        Every step may be repeated, files already moved by an interrupted run are detected, so the command may be
+        simply restarted.
+        """
+        old_name = media.file.name
+        name = generate_upload_path(media, old_name)
+        if name == old_name:
+            return name
+        # The old thumbnail name is derived from the old file name, so the thumbnail is moved while it's known
+        old_thumbnail = self.old_thumbnail_namer(media.thumbnail.generator)
+        media.file.name = name
+        try:
+            self.move(old_thumbnail, media.thumbnail.name)
+            self.move(old_name, name, required=True)
+        except (OSError, NotImplementedError) as exc:
+            self.stderr.write('Relocating {} failed: {}'.format(old_name, exc))
+            return None
+        finally:
+            media.file.name = old_name
+        return name
+
+    def move(self, old_name, name, required=False):
+        if not default_storage.exists(old_name):
+            # Moved already or missing, like thumbnails never generated
+            if required and not default_storage.exists(name):
+                raise FileNotFoundError('Neither {} nor {} exists'.format(old_name, name))
+            return
+        if default_storage.exists(name):
+            # Deduplicated copy stored already
+            default_storage.delete(old_name)
+            return
+        try:
+            path = default_storage.path(name)
+        except NotImplementedError:
+            # Object storage, copy and delete
+            pass
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(default_storage.path(old_name), path)
+            return
+        with default_storage.open(old_name) as file:
+            default_storage.save(name, file)
+        default_storage.delete(old_name)
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.10 on 2026-10-18 14:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0002_auto_20160715_2035'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediafilemodel',
+            name='file_size',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='mediafilemodel',
+            name='original_size',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+    ]
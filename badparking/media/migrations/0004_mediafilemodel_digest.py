@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.10 on 2026-10-18 15:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0003_mediafilemodel_sizes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediafilemodel',
+            name='digest',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.10 on 2026-10-18 16:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0004_mediafilemodel_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediafilemodel',
+            name='height',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='mediafilemodel',
+            name='mime_type',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='mediafilemodel',
+            name='width',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+    ]
@@ -1,14 +1,19 @@
 from pathlib import Path
-from uuid import uuid4
-from datetime import datetime
 
+from django.conf import settings
 from django.db import models
 from imagekit.models import ImageSpecField
 from imagekit.processors import ResizeToFill
+from imagekit.cachefiles.strategies import Optimistic
+
+from .ingest import normalize_image, file_digest, image_info
+from .thumbnails import ThreadPoolBackend
+from .utils import sharded_name
 
 
 def generate_upload_path(instance, filename):
-    return 'images/{}/{}{}'.format(datetime.now().strftime('%Y/%m/%d'), uuid4().hex, Path(filename).suffix)
+    # Content addressed, so that the same upload is stored only once
+    return sharded_name('images', instance.digest, Path(filename).suffix)
 
 
 class MediaFileModel(models.Model):
@@ -16,17 +21,64 @@ class MediaFileModel(models.Model):
     thumbnail = ImageSpecField(source='file',
                                processors=[ResizeToFill(100, 100)],
                                format='JPEG',
-                               options={'quality': 60})
+                               options={'quality': 60},
+                               cachefile_backend=ThreadPoolBackend(),
+                               cachefile_strategy=Optimistic())
     original_filename = models.CharField(max_length=255, default='')
+    # Byte counts of the uploaded and the stored file, unknown for files uploaded before normalization
+    original_size = models.PositiveIntegerField(null=True, editable=False)
+    file_size = models.PositiveIntegerField(null=True, editable=False)
+    # SHA-256 of the uploaded content, media with the same digest share the stored file and thumbnail
+    digest = models.CharField(max_length=64, default='', editable=False, db_index=True)
+    # Not `width_field` and `height_field` of the image field, which would open files of older media on every load
+    width = models.PositiveIntegerField(null=True, editable=False)
+    height = models.PositiveIntegerField(null=True, editable=False)
+    mime_type = models.CharField(max_length=255, default='', editable=False)
     created_at = models.DateTimeField(editable=False, auto_now_add=True)
 
     @property
     def size(self):
+        if self.file_size is not None:
+            return self.file_size
         return self.file.size
 
     @property
     def url(self):
         return self.file.url
 
+    def save(self, *args, **kwargs):
+        if self.file and not self.file._committed:
+            self.ingest()
+        super(MediaFileModel, self).save(*args, **kwargs)
+
+    def ingest(self):
+        """
+        Normalizes the newly uploaded file before it's stored, as configured by the `MEDIA_IMAGE_*` settings.
+        If the same content has been uploaded before, its stored file is reused instead.
+        """
+        self.original_size = self.file.size
+        self.digest = file_digest(self.file)
+        stored = MediaFileModel.objects.filter(digest=self.digest)\
+            .values_list('file', 'file_size', 'width', 'height', 'mime_type').first()
+        if stored:
+            self.file, self.file_size, self.width, self.height, self.mime_type = stored
+            return
+
+        if settings.MEDIA_IMAGE_NORMALIZATION:
+            normalized = normalize_image(self.file, settings.MEDIA_IMAGE_MAX_DIMENSION, settings.MEDIA_IMAGE_QUALITY)
+            if normalized is not None:
+                self.file = normalized
+        self.file_size = self.file.size
+        self.width, self.height, self.mime_type = image_info(self.file)
+
+    def delete_files(self):
+        """
+        Deletes the file and its generated thumbnail from the storage. Only the file name is needed, so it works
+        for instances whose rows are already deleted. Make sure no other media shares the file first.
+        """
+        thumbnail = self.thumbnail
+        thumbnail.storage.delete(thumbnail.name)
+        self.file.storage.delete(self.file.name)
+
     def __str__(self):
         return '<{} created at {}>'.format(self.file.name, self.created_at)
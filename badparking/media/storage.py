@@ -0,0 +1,132 @@
+import mimetypes
+import posixpath
+
+from tempfile import SpooledTemporaryFile
+from threading import Lock
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import File
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+from django.utils.encoding import filepath_to_uri
+
+try:
+    import boto3
+    from botocore.client import Config
+    from botocore.exceptions import ClientError
+    from boto3.s3.transfer import TransferConfig
+except ImportError:
+    boto3 = None
+
+
+@deconstructible
+class S3Storage(Storage):
+    """
+    Storage keeping files in a bucket of Amazon S3 or a compatible object storage, configured by `MEDIA_S3`.
+
+    A single client with a pool of keep-alive connections is shared by all the threads. Files larger than
+    the multipart threshold are uploaded in parts concurrently. Files are downloaded into a spooled temporary file
+    on open, so that only small ones stay in memory.
+    """
+    def __init__(self, **options):
+        if boto3 is None:
+            raise ImproperlyConfigured('boto3 is required by S3Storage')
+        self.options = dict(settings.MEDIA_S3, **options)
+        if not self.options.get('bucket'):
+            raise ImproperlyConfigured('S3 bucket is not configured')
+        self.bucket = self.options['bucket']
+        self.transfer_config = TransferConfig(multipart_threshold=self.options['multipart_threshold'],
+                                              multipart_chunksize=self.options['multipart_chunksize'])
+        self._client = None
+        self._client_lock = Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = boto3.session.Session().client(
+                        's3',
+                        endpoint_url=self.options.get('endpoint_url'),
+                        region_name=self.options.get('region_name'),
+                        aws_access_key_id=self.options.get('access_key_id'),
+                        aws_secret_access_key=self.options.get('secret_access_key'),
+                        config=Config(signature_version='s3v4',
+                                      max_pool_connections=self.options['max_pool_connections']))
+        return self._client
+
+    def _open(self, name, mode='rb'):
+        content = SpooledTemporaryFile(max_size=self.options['spool_size'])
+        self.client.download_fileobj(self.bucket, name, content, Config=self.transfer_config)
+        content.seek(0)
+        return File(content, name)
+
+    def _save(self, name, content):
+        extra_args = {'ContentType': mimetypes.guess_type(name)[0] or 'application/octet-stream'}
+        if hasattr(content, 'temporary_file_path'):
+            # Parts are read by several threads straight from the file
+            self.client.upload_file(content.temporary_file_path(), self.bucket, name, ExtraArgs=extra_args,
+                                    Config=self.transfer_config)
+        else:
+            content.seek(0)
+            self.client.upload_fileobj(content, self.bucket, name, ExtraArgs=extra_args, Config=self.transfer_config)
+        return name
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=name)
+
+    def exists(self, name):
+        try:
+            self._head(name)
+        except ClientError as exc:
+            if exc.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return False
+            raise
+        return True
+
+    def size(self, name):
+        return self._head(name)['ContentLength']
+
+    def modified_time(self, name):
+        return self._head(name)['LastModified']
+
+    def listdir(self, path):
+        prefix = self._prefix(path)
+        directories, files = [], []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter='/'):
+            directories.extend(posixpath.basename(p['Prefix'].rstrip('/')) for p in page.get('CommonPrefixes', ()))
+            files.extend(posixpath.basename(o['Key']) for o in page.get('Contents', ()))
+        return directories, files
+
+    def scan(self, path):
+        """
+        Yields names and modification timestamps of all the files under `path`, page by page.
+        """
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._prefix(path)):
+            for obj in page.get('Contents', ()):
+                yield obj['Key'], obj['LastModified'].timestamp()
+
+    def url(self, name):
+        if self.options.get('base_url'):
+            return '{}/{}'.format(self.options['base_url'].rstrip('/'), filepath_to_uri(name))
+        return self.client.generate_presigned_url('get_object', Params={'Bucket': self.bucket, 'Key': name},
+                                                  ExpiresIn=self.options['url_expiration'])
+
+    def presigned_upload(self, name, max_size, expiration=None):
+        """
+        Returns a dict with `url` and form `fields` for a client to POST the file `name` of up to `max_size` bytes
+        straight to the bucket.
+        """
+        return self.client.generate_presigned_post(
+            self.bucket, name, Conditions=[['content-length-range', 1, max_size]],
+            ExpiresIn=expiration or self.options['url_expiration'])
+
+    def _head(self, name):
+        return self.client.head_object(Bucket=self.bucket, Key=name)
+
+    def _prefix(self, path):
+        path = path.strip('/')
+        return path + '/' if path else ''
@@ -1,3 +1,521 @@
-from django.test import TestCase
+import os
+import cgi
+import json
+import time
+import uuid
+import struct
+import shutil
+import tempfile
+import requests
 
-# Create your tests here.
+from io import BytesIO, StringIO
+from base64 import b64decode
+from hashlib import sha256, md5
+from threading import Thread, Lock
+from unittest.mock import patch
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from email.utils import formatdate
+from urllib.parse import urlparse, parse_qs, unquote
+from xml.sax.saxutils import escape
+
+from PIL import Image
+
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from imagekit.cachefiles.namers import hash as hash_namer
+
+from mobile_api.serializers import MediaFileSerializer
+
+from .models import MediaFileModel
+from .management.commands.gcmedia import Command as GarbageCollectionCommand
+from .management.commands.relocatemedia import Command as RelocateCommand
+from .storage import S3Storage
+from .utils import BloomFilter
+from .thumbnails import ThreadPoolBackend
+
+
+class BloomFilterTests(SimpleTestCase):
+    def test_membership(self):
+        bloom = BloomFilter(1000)
+        items = ['images/2016/10/{}.jpg'.format(i) for i in range(1000)]
+        for item in items:
+            bloom.add(item)
+        self.assertTrue(all(item in bloom for item in items))
+        false_positives = sum('images/2016/11/{}.jpg'.format(i) in bloom for i in range(10000))
+        self.assertLess(false_positives, 50)
+
+
+class MediaStorageTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def _image(self, name='photo.jpg', size=(400, 300), format='JPEG', **options):
+        content = BytesIO()
+        Image.new('RGB', size, 'red').save(content, format, **options)
+        return ContentFile(content.getvalue(), name=name)
+
+
+@patch.object(ThreadPoolBackend, 'schedule_generation')
+class IngestTests(MediaStorageTestCase):
+    def _exif(self, orientation):
+        # Little endian TIFF header with a single IFD entry
+        return (b'Exif\x00\x00II*\x00\x08\x00\x00\x00\x01\x00' + struct.pack('<HHIHH', 274, 3, 1, orientation, 0) +
+                b'\x00\x00\x00\x00')
+
+    @override_settings(MEDIA_IMAGE_MAX_DIMENSION=600, MEDIA_IMAGE_QUALITY=70)
+    def test_normalization(self, schedule_generation):
+        upload = self._image(size=(1200, 800), exif=self._exif(6))
+        media = MediaFileModel.objects.create(file=upload)
+        self.assertEqual(media.original_size, upload.size)
+        self.assertEqual(media.file_size, default_storage.size(media.file.name))
+
+        with default_storage.open(media.file.name) as stored:
+            image = Image.open(stored)
+            self.assertEqual(image.format, 'JPEG')
+            # Rotated upright and downscaled
+            self.assertEqual(image.size, (400, 600))
+            self.assertNotIn('exif', image.info)
+        self.assertEqual((media.width, media.height, media.mime_type), (400, 600, 'image/jpeg'))
+
+        media = MediaFileModel.objects.get(pk=media.pk)
+        with patch('django.core.files.storage.FileSystemStorage.size') as storage_size:
+            data = MediaFileSerializer(media).data
+            storage_size.assert_not_called()
+        self.assertEqual(data['size'], media.file_size)
+        self.assertEqual((data['width'], data['height'], data['mime_type']), (400, 600, 'image/jpeg'))
+
+    def test_other_formats_are_converted(self, schedule_generation):
+        media = MediaFileModel.objects.create(file=self._image(name='photo.png', format='PNG'))
+        self.assertTrue(media.file.name.endswith('.jpg'))
+        with default_storage.open(media.file.name) as stored:
+            self.assertEqual(Image.open(stored).size, (400, 300))
+
+    @override_settings(MEDIA_IMAGE_NORMALIZATION=False)
+    def test_disabled(self, schedule_generation):
+        upload = self._image(name='photo.png', format='PNG')
+        media = MediaFileModel.objects.create(file=upload)
+        self.assertTrue(media.file.name.endswith('.png'))
+        self.assertEqual(media.original_size, media.file_size)
+
+
+class ThumbnailTests(MediaStorageTestCase):
+    def test_generated_in_background_on_upload(self):
+        futures = []
+        schedule_generation = ThreadPoolBackend.schedule_generation
+
+        def schedule(backend, file, force=False):
+            futures.append(schedule_generation(backend, file, force))
+            return futures[-1]
+
+        with patch.object(ThreadPoolBackend, 'schedule_generation', schedule):
+            media = MediaFileModel.objects.create(file=self._image())
+        self.assertEqual(len(futures), 1)
+        futures[0].result(timeout=10)
+        self.assertTrue(default_storage.exists(media.thumbnail.name))
+
+    def test_rendering_does_not_generate(self):
+        with patch.object(ThreadPoolBackend, 'schedule_generation'):
+            media = MediaFileModel.objects.create(file=self._image())
+        with patch.object(ThreadPoolBackend, 'generate_now') as generate_now:
+            media = MediaFileModel.objects.get(pk=media.pk)
+            self.assertTrue(media.thumbnail.url)
+            generate_now.assert_not_called()
+
+
+@patch.object(ThreadPoolBackend, 'schedule_generation')
+class DeduplicationTests(MediaStorageTestCase):
+    def test_same_content_shares_file(self, schedule_generation):
+        first = MediaFileModel.objects.create(file=self._image(name='first.jpg'))
+        second = MediaFileModel.objects.create(file=self._image(name='second.jpg'))
+        other = MediaFileModel.objects.create(file=self._image(size=(300, 400)))
+
+        self.assertEqual(first.digest, second.digest)
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(first.thumbnail.name, second.thumbnail.name)
+        self.assertEqual(second.file_size, first.file_size)
+        self.assertNotEqual(other.file.name, first.file.name)
+        stored = [name for _, _, names in os.walk(default_storage.path('images')) for name in names]
+        self.assertEqual(len(stored), 2)
+
+
+class GarbageCollectionTests(MediaStorageTestCase):
+    def _save(self, name, age=48):
+        name = default_storage.save(name, ContentFile(b'image'))
+        mtime = time.time() - age * 3600
+        os.utime(default_storage.path(name), (mtime, mtime))
+        return name
+
+    def test_orphans_are_deleted(self):
+        referenced = MediaFileModel.objects.create(file=self._save('images/2016/10/06/referenced.jpg'))
+        thumbnail = self._save(referenced.thumbnail.name)
+        orphan = self._save('images/2016/10/05/orphan.jpg')
+        orphan_thumbnail = self._save('CACHE/images/orphan.jpg')
+        fresh = self._save('images/2016/10/07/fresh.jpg', age=0)
+
+        out = StringIO()
+        call_command('gcmedia', dry_run=True, stdout=out)
+        self.assertIn(orphan, out.getvalue())
+        self.assertTrue(default_storage.exists(orphan))
+
+        call_command('gcmedia', stdout=StringIO())
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertFalse(default_storage.exists(orphan_thumbnail))
+        for name in (referenced.file.name, thumbnail, fresh):
+            self.assertTrue(default_storage.exists(name))
+
+    def test_files_referenced_during_scan_are_kept(self):
+        name = self._save('images/2016/10/05/reused.jpg')
+        thumbnail = self._save(MediaFileModel(file=name).thumbnail.name)
+        scan_storage = GarbageCollectionCommand.scan_storage
+
+        def scan(command):
+            # Deduplicated onto the old file after the references were loaded
+            MediaFileModel.objects.create(file=name)
+            yield from scan_storage(command)
+
+        out = StringIO()
+        with patch.object(GarbageCollectionCommand, 'scan_storage', scan):
+            call_command('gcmedia', stdout=out)
+        self.assertIn('0 deleted orphaned', out.getvalue())
+        self.assertTrue(default_storage.exists(name))
+        self.assertTrue(default_storage.exists(thumbnail))
+
+
+class RelocationTests(MediaStorageTestCase):
+    def test_legacy_layout(self):
+        names = ['images/2016/10/06/first.jpg', 'images/2016/10/06/second.jpg']
+        media = []
+        for name, content in zip(names, (b'first', b'second')):
+            media.append(MediaFileModel.objects.create(file=default_storage.save(name, ContentFile(content))))
+            default_storage.save(hash_namer(media[-1].thumbnail.generator), ContentFile(b'thumbnail'))
+
+        out = StringIO()
+        call_command('relocatemedia', batch_size=1, stdout=out)
+        self.assertIn('Relocated 2 media, 0 failed', out.getvalue())
+        for old_name, content, item in zip(names, (b'first', b'second'), media):
+            item = MediaFileModel.objects.get(pk=item.pk)
+            self.assertEqual(item.digest, sha256(content).hexdigest())
+            self.assertEqual(item.file.name, 'images/{}/{}/{}.jpg'.format(item.digest[:2], item.digest[2:4],
+                                                                          item.digest))
+            self.assertFalse(default_storage.exists(old_name))
+            with default_storage.open(item.file.name) as file:
+                self.assertEqual(file.read(), content)
+            self.assertTrue(default_storage.exists(item.thumbnail.name))
+            self.assertEqual(item.file_size, len(content))
+
+        # Nothing left to do
+        out = StringIO()
+        call_command('relocatemedia', stdout=out)
+        self.assertIn('Relocated 0 media, 0 failed', out.getvalue())
+
+    def test_metadata_backfill(self):
+        with patch.object(ThreadPoolBackend, 'schedule_generation'):
+            media = MediaFileModel.objects.create(file=self._image(size=(400, 300)))
+        # Stored before the metadata was
+        MediaFileModel.objects.filter(pk=media.pk).update(file_size=None, width=None, height=None, mime_type='')
+
+        out = StringIO()
+        call_command('relocatemedia', stdout=out)
+        self.assertIn('Relocated 0 media, 0 failed', out.getvalue())
+        media = MediaFileModel.objects.get(pk=media.pk)
+        self.assertEqual(media.file_size, default_storage.size(media.file.name))
+        self.assertEqual((media.width, media.height, media.mime_type), (400, 300, 'image/jpeg'))
+
+    def test_interrupted(self):
+        name = 'images/2016/10/06/first.jpg'
+        media = MediaFileModel.objects.create(file=default_storage.save(name, ContentFile(b'first')))
+        default_storage.save(hash_namer(media.thumbnail.generator), ContentFile(b'thumbnail'))
+
+        # Files are moved, but the command dies before their new names are stored
+        with patch.object(RelocateCommand, 'rename', side_effect=RuntimeError('Interrupted')),\
+                self.assertRaises(RuntimeError):
+            call_command('relocatemedia', stdout=StringIO())
+        media.refresh_from_db()
+        self.assertEqual(media.file.name, name)
+        self.assertTrue(media.digest)
+        self.assertFalse(default_storage.exists(name))
+
+        out = StringIO()
+        call_command('relocatemedia', stdout=out)
+        self.assertIn('Relocated 1 media, 0 failed', out.getvalue())
+        media.refresh_from_db()
+        with default_storage.open(media.file.name) as file:
+            self.assertEqual(file.read(), b'first')
+        self.assertTrue(default_storage.exists(media.thumbnail.name))
+
+    def test_deduplicated_during_move(self):
+        name = 'images/2016/10/06/first.jpg'
+        media = MediaFileModel.objects.create(file=default_storage.save(name, ContentFile(b'first')))
+        rename = RelocateCommand.rename
+
+        def upload_and_rename(command, renamed):
+            # Upload of the same content committed while the file was being moved, not part of the batch
+            MediaFileModel.objects.create(file=name, digest=sha256(b'first').hexdigest())
+            return rename(command, renamed)
+
+        out = StringIO()
+        with patch.object(RelocateCommand, 'rename', upload_and_rename):
+            call_command('relocatemedia', stdout=out)
+        self.assertIn('Relocated 2 media, 0 failed', out.getvalue())
+        media.refresh_from_db()
+        self.assertEqual(set(MediaFileModel.objects.values_list('file', flat=True)), {media.file.name})
+        self.assertTrue(default_storage.exists(media.file.name))
+
+    def test_failed_thumbnail(self):
+        name = 'images/2016/10/06/first.jpg'
+        media = MediaFileModel.objects.create(file=default_storage.save(name, ContentFile(b'first')))
+        default_storage.save(hash_namer(media.thumbnail.generator), ContentFile(b'thumbnail'))
+
+        move = RelocateCommand.move
+
+        def fail_thumbnails(command, old_name, new_name, required=False):
+            if not required:
+                raise OSError('No space left on device')
+            move(command, old_name, new_name, required)
+
+        out = StringIO()
+        with patch.object(RelocateCommand, 'move', fail_thumbnails):
+            call_command('relocatemedia', stdout=out, stderr=StringIO())
+        self.assertIn('Relocated 0 media, 1 failed', out.getvalue())
+        # Nothing is moved until the thumbnail is
+        media.refresh_from_db()
+        self.assertEqual(media.file.name, name)
+        self.assertTrue(default_storage.exists(name))
+
+        out = StringIO()
+        call_command('relocatemedia', stdout=out)
+        self.assertIn('Relocated 1 media, 0 failed', out.getvalue())
+
+
+class FakeS3Server(ThreadingMixIn, HTTPServer):
+    """
+    Local stand-in for an S3 compatible object storage with a single bucket, addressed by path.
+    """
+    daemon_threads = True
+
+    def __init__(self, bucket):
+        super(FakeS3Server, self).__init__(('127.0.0.1', 0), FakeS3Handler)
+        self.bucket = bucket
+        self.objects = {}  # Key to a pair of content and modification time
+        self.uploads = {}  # Multipart upload ID to a dict of parts by number
+        self.requests = []  # Method, key and query of each request
+        self.lock = Lock()
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address)
+
+
+class FakeS3Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    namespace = 'http://s3.amazonaws.com/doc/2006-03-01/'
+
+    def do_HEAD(self):
+        key, query = self._parse()
+        if key not in self.server.objects:
+            return self._respond(404)
+        content, modified = self.server.objects[key]
+        self._respond(200, headers=self._object_headers(content, modified), length=len(content))
+
+    def do_GET(self):
+        key, query = self._parse()
+        if not key:
+            return self._list(query)
+        if key not in self.server.objects:
+            return self._error(404, 'NoSuchKey')
+        content, modified = self.server.objects[key]
+        headers = self._object_headers(content, modified)
+        if 'Range' in self.headers:
+            first, last = self.headers['Range'][len('bytes='):].split('-')
+            last = min(int(last or len(content) - 1), len(content) - 1)
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(first, last, len(content))
+            return self._respond(206, content[int(first):last + 1], headers)
+        self._respond(200, content, headers)
+
+    def do_PUT(self):
+        key, query = self._parse()
+        content = self._read_body()
+        if 'uploadId' in query:
+            self.server.uploads[query['uploadId'][0]][int(query['partNumber'][0])] = content
+            return self._respond(200, headers={'ETag': '"{}"'.format(md5(content).hexdigest())})
+        self._store(key, content)
+        self._respond(200, headers={'ETag': '"{}"'.format(md5(content).hexdigest())})
+
+    def do_POST(self):
+        key, query = self._parse()
+        if not key:
+            return self._form_upload()
+        self._read_body()
+        if 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            self.server.uploads[upload_id] = {}
+            return self._respond(200, self._xml('InitiateMultipartUploadResult', '<Bucket>{}</Bucket><Key>{}</Key>'
+                                                '<UploadId>{}</UploadId>'.format(self.server.bucket, escape(key),
+                                                                                 upload_id)))
+        parts = self.server.uploads.pop(query['uploadId'][0])
+        content = b''.join(parts[number] for number in sorted(parts))
+        self._store(key, content)
+        self._respond(200, self._xml('CompleteMultipartUploadResult', '<Key>{}</Key><ETag>"{}"</ETag>'.format(
+            escape(key), md5(content).hexdigest())))
+
+    def do_DELETE(self):
+        key, query = self._parse()
+        with self.server.lock:
+            self.server.objects.pop(key, None)
+        self._respond(204)
+
+    def _parse(self):
+        url = urlparse(self.path)
+        bucket, _, key = url.path.lstrip('/').partition('/')
+        query = parse_qs(url.query, keep_blank_values=True)
+        self.server.requests.append((self.command, unquote(key), query))
+        if bucket != self.server.bucket:
+            raise ValueError('Unknown bucket {}'.format(bucket))
+        return unquote(key), query
+
+    def _read_body(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if 'aws-chunked' not in self.headers.get('Content-Encoding', ''):
+            return body
+        # Streamed payload of chunks, each prefixed by its hex size and followed by optional trailers
+        content = BytesIO()
+        while True:
+            header, body = body.split(b'\r\n', 1)
+            size = int(header.split(b';')[0], 16)
+            if not size:
+                return content.getvalue()
+            content.write(body[:size])
+            body = body[size + 2:]
+
+    def _store(self, key, content):
+        with self.server.lock:
+            self.server.objects[key] = (content, time.time())
+
+    def _list(self, query):
+        prefix = query.get('prefix', [''])[0]
+        delimiter = query.get('delimiter', [''])[0]
+        contents, prefixes = [], set()
+        for key, (content, modified) in sorted(self.server.objects.items()):
+            if not key.startswith(prefix):
+                continue
+            rest = key[len(prefix):]
+            if delimiter and delimiter in rest:
+                prefixes.add(prefix + rest.split(delimiter, 1)[0] + delimiter)
+            else:
+                contents.append('<Contents><Key>{}</Key><LastModified>{}</LastModified><Size>{}</Size>'
+                                '<ETag>"{}"</ETag></Contents>'.format(
+                                    escape(key), time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(modified)),
+                                    len(content), md5(content).hexdigest()))
+        common = ''.join('<CommonPrefixes><Prefix>{}</Prefix></CommonPrefixes>'.format(escape(p))
+                         for p in sorted(prefixes))
+        self._respond(200, self._xml('ListBucketResult', '<Name>{}</Name><Prefix>{}</Prefix><KeyCount>{}</KeyCount>'
+                                     '<IsTruncated>false</IsTruncated>{}{}'.format(
+                                         self.server.bucket, escape(prefix), len(contents) + len(prefixes),
+                                         ''.join(contents), common)))
+
+    def _form_upload(self):
+        form = cgi.FieldStorage(fp=self.rfile, headers=self.headers, environ={
+            'REQUEST_METHOD': 'POST', 'CONTENT_TYPE': self.headers['Content-Type']})
+        content = form['file'].file.read()
+        policy = json.loads(b64decode(form.getfirst('policy')).decode('utf8'))
+        for condition in policy['conditions']:
+            if isinstance(condition, list) and condition[0] == 'content-length-range':
+                if not condition[1] <= len(content) <= condition[2]:
+                    return self._error(400, 'EntityTooLarge')
+        self._store(form.getfirst('key'), content)
+        self._respond(204)
+
+    def _object_headers(self, content, modified):
+        return {'Last-Modified': formatdate(modified, usegmt=True), 'ETag': '"{}"'.format(md5(content).hexdigest()),
+                'Accept-Ranges': 'bytes'}
+
+    def _xml(self, root, body):
+        return '<?xml version="1.0" encoding="UTF-8"?><{0} xmlns="{1}">{2}</{0}>'.format(
+            root, self.namespace, body).encode('utf8')
+
+    def _error(self, status, code):
+        self._respond(status, self._xml('Error', '<Code>{}</Code><Message>{}</Message>'.format(code, code)))
+
+    def _respond(self, status, body=b'', headers=None, length=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body) if length is None else length))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class S3StorageTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(S3StorageTests, cls).setUpClass()
+        cls.s3 = FakeS3Server('media')
+        Thread(target=cls.s3.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.s3.shutdown()
+        cls.s3.server_close()
+        super(S3StorageTests, cls).tearDownClass()
+
+    def setUp(self):
+        self.s3.objects = {}
+        self.s3.uploads = {}
+        self.s3.requests = []
+        self.storage = S3Storage(bucket='media', endpoint_url=self.s3.url, region_name='us-east-1',
+                                 access_key_id='test', secret_access_key='test',
+                                 multipart_threshold=5 * 1024 * 1024, multipart_chunksize=5 * 1024 * 1024)
+
+    def test_files(self):
+        name = self.storage.save('images/ab/photo.jpg', ContentFile(b'image'))
+        self.assertEqual(name, 'images/ab/photo.jpg')
+        self.assertTrue(self.storage.exists(name))
+        self.assertFalse(self.storage.exists('images/ab/missing.jpg'))
+        self.assertEqual(self.storage.size(name), 5)
+        with self.storage.open(name) as file:
+            self.assertEqual(file.read(), b'image')
+        self.assertEqual(self.storage.listdir('images'), (['ab'], []))
+        self.assertEqual([n for n, _ in self.storage.scan('images')], [name])
+        self.assertIn('photo.jpg', self.storage.url(name))
+
+        # Taken name gets a suffix
+        self.assertNotEqual(self.storage.save(name, ContentFile(b'other')), name)
+
+        self.storage.delete(name)
+        self.assertFalse(self.storage.exists(name))
+
+    def test_multipart_upload(self):
+        content = os.urandom(11 * 1024 * 1024)
+        with tempfile.NamedTemporaryFile() as staged:
+            staged.write(content)
+            staged.flush()
+            file = ContentFile(b'', name='large.jpg')
+            file.temporary_file_path = lambda: staged.name
+            name = self.storage.save('images/large.jpg', file)
+        parts = [query['partNumber'][0] for method, _, query in self.s3.requests if 'partNumber' in query]
+        self.assertEqual(sorted(parts), ['1', '2', '3'])
+        with self.storage.open(name) as file:
+            self.assertEqual(file.read(), content)
+
+    def test_presigned_upload(self):
+        upload = self.storage.presigned_upload('images/direct.jpg', max_size=1024)
+        self.assertEqual(upload['fields']['key'], 'images/direct.jpg')
+        response = requests.post(upload['url'], data=upload['fields'], files={'file': b'image'})
+        self.assertEqual(response.status_code, 204)
+        with self.storage.open('images/direct.jpg') as file:
+            self.assertEqual(file.read(), b'image')
+
+        response = requests.post(upload['url'], data=upload['fields'], files={'file': b'x' * 1025})
+        self.assertEqual(response.status_code, 400)
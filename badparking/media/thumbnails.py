@@ -0,0 +1,45 @@
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from imagekit.utils import format_to_extension
+from imagekit.cachefiles.backends import BaseAsync, CacheFileState
+
+from .utils import sharded_name
+
+
+logger = logging.getLogger(__name__)
+
+
+def sharded_hash_namer(generator):
+    """
+    Imagekit namer like `imagekit.cachefiles.namers.hash`, but spreading the files over hash prefix subdirectories.
+    """
+    format = getattr(generator, 'format', None)
+    return sharded_name(settings.IMAGEKIT_CACHEFILE_DIR, generator.get_hash(),
+                        format_to_extension(format) if format else '')
+
+
+class ThreadPoolBackend(BaseAsync):
+    """
+    Imagekit cache file backend generating the files in a pool of background threads of the current process.
+
+    Combined with the optimistic strategy thumbnails are scheduled as soon as their source is saved, and rendering
+    their URLs never waits for image processing. A thumbnail is lost if the process exits before generating it,
+    the `generateimages` command fills such gaps.
+    """
+    def __init__(self, max_workers=None):
+        super(ThreadPoolBackend, self).__init__()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or settings.MEDIA_THUMBNAIL_WORKERS)
+
+    def schedule_generation(self, file, force=False):
+        return self.executor.submit(self._generate, file, force)
+
+    def _generate(self, file, force):
+        try:
+            self.generate_now(file, force=force)
+        except Exception:
+            # Let the next save or `generateimages` retry it
+            self.set_state(file, CacheFileState.DOES_NOT_EXIST)
+            logger.exception('Generating %s failed', file.name)
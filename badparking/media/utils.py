@@ -0,0 +1,42 @@
+import math
+import posixpath
+
+from hashlib import sha256
+
+from django.conf import settings
+
+
+class BloomFilter(object):
+    """
+    Probabilistic set of strings taking about 1.2 bytes per item at the default error rate.
+
+    Membership tests never give false negatives, only false positives with the probability of `error_rate`
+    once `capacity` items are added.
+    """
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1)
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        # Double hashing, two 64 bit halves of a single digest give all the positions
+        digest = sha256(item.encode('utf8')).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:16], 'little')
+        return ((first + i * second) % self.size for i in range(self.hash_count))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+def sharded_name(directory, digest, suffix=''):
+    """
+    Returns a name of the file under `directory` nested in `MEDIA_SHARD_LEVELS` subdirectories named by the leading
+    hex pairs of `digest`. Each level fans out to at most 256 subdirectories, so none of them grows too large.
+    """
+    shards = [digest[level * 2:level * 2 + 2] for level in range(settings.MEDIA_SHARD_LEVELS)]
+    return posixpath.join(directory, *shards + [digest + suffix])
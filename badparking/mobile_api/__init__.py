@@ -0,0 +1 @@
+default_app_config = 'mobile_api.apps.MobileApiConfig'
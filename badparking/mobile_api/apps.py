@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class MobileApiConfig(AppConfig):
     name = 'mobile_api'
+
+    def ready(self):
+        # Connect signal receivers
+        from . import signals  # noqa
@@ -0,0 +1,49 @@
+from uuid import UUID
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Client
+from .utils import LocalCache
+
+
+CLIENT_CACHE_KEY = 'mobile_api:client:{}'
+
+
+# Other processes only learn about invalidation through the shared cache, hence the local timeout is kept short
+_local_clients = LocalCache(maxsize=128, timeout=settings.API_CLIENT_LOCAL_CACHE_TIMEOUT)
+
+
+def get_active_client(client_id):
+    """
+    Returns an active `Client` by `client_id` with its permission codenames preloaded.
+
+    Looks up the process-local cache first, then the shared one and only then the database.
+    Raises `Client.DoesNotExist` if there is no such active client.
+    """
+    try:
+        # Normalize the ID, so that the same client always maps to the same key
+        client_id = UUID(str(client_id))
+    except ValueError:
+        raise Client.DoesNotExist()
+
+    key = CLIENT_CACHE_KEY.format(client_id)
+    client = _local_clients.get(key)
+    if client is None:
+        client = cache.get(key)
+        if client is None:
+            client = Client.objects.get(id=client_id, is_active=True)
+            client.get_perm_codenames()
+            cache.set(key, client, settings.API_CLIENT_CACHE_TIMEOUT)
+        _local_clients.set(key, client)
+    return client
+
+
+def invalidate_client(client_id):
+    key = CLIENT_CACHE_KEY.format(client_id)
+    _local_clients.delete(key)
+    cache.delete(key)
+
+
+def clear_local_clients():
+    _local_clients.clear()
@@ -0,0 +1,46 @@
+import facepy
+import requests
+
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from django.conf import settings
+
+
+def _create_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.FACEBOOK_API_POOL_SIZE, max_retries=Retry(
+        total=settings.FACEBOOK_API_RETRIES, backoff_factor=0.2, status_forcelist=(500, 502, 503, 504),
+        method_whitelist=frozenset(['GET']), raise_on_status=False))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.hooks['response'].append(_raise_for_server_error)
+    return session
+
+
+def _raise_for_server_error(response, **kwargs):
+    # Server errors left after the retries are raised as a failed request instead of being parsed by facepy into
+    # a `FacebookError`, which would be indistinguishable from an invalid access token
+    if 500 <= response.status_code < 600:
+        response.raise_for_status()
+
+
+class GraphAPI(facepy.GraphAPI):
+    """
+    Facebook Graph API client sending the requests over a keep-alive session shared by all the instances, instead
+    of connecting anew for every access token. Requests time out after `FACEBOOK_API_TIMEOUT` seconds.
+
+    Requests failing to connect or with a server error are retried by the session, raising `facepy.HTTPError` once
+    the retries are exhausted. Errors of the Graph API itself, such as invalid access tokens, are not retried as
+    they would be by facepy.
+    """
+    def __init__(self, oauth_token, **kwargs):
+        kwargs.setdefault('url', settings.FACEBOOK_API_URL)
+        kwargs.setdefault('timeout', settings.FACEBOOK_API_TIMEOUT)
+        super(GraphAPI, self).__init__(oauth_token, **kwargs)
+        self.session = shared_session
+
+    def get(self, path='', page=False, retry=0, **options):
+        return super(GraphAPI, self).get(path, page=page, retry=retry, **options)
+
+
+shared_session = _create_session()
@@ -0,0 +1,16 @@
+import django_filters
+
+from core.models import CrimeType, Claim
+
+
+class ClaimFilter(django_filters.FilterSet):
+    # Any of the given crime types, matched against the denormalized array instead of joining the relation
+    crimetypes = django_filters.ModelMultipleChoiceFilter(queryset=CrimeType.objects.all(),
+                                                          method='filter_crimetypes')
+
+    class Meta:
+        model = Claim
+        fields = ('status', 'crimetypes', 'city', 'created_at')
+
+    def filter_crimetypes(self, queryset, name, value):
+        return queryset.filter(crimetype_ids__overlap=[crimetype.pk for crimetype in value])
@@ -1,6 +1,7 @@
 from rest_framework import exceptions
 
 from .models import Client
+from .cache import get_active_client
 
 
 class ClientAuthMixin:
@@ -12,7 +13,7 @@ class ClientAuthMixin:
             raise exceptions.NotAuthenticated()
 
         try:
-            client = Client.objects.get(id=client_id, is_active=True)
+            client = get_active_client(client_id)
             client.verify_secret(client_secret, timestamp, raise_exception=True)
         except (Client.DoesNotExist, ValueError):
             raise exceptions.AuthenticationFailed()
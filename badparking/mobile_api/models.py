@@ -6,8 +6,18 @@ from hashlib import sha256
 
 from django.db import models
 from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth.models import Permission
 
+from .utils import LocalCache
+
+
+NONCE_CACHE_KEY = 'mobile_api:nonce:{}:{}'
+
+# Signed URLs are valid for the threshold either way from their timestamp, so are their cached signatures
+_signatures = LocalCache(maxsize=settings.API_CLIENT_SIGNATURE_CACHE_SIZE,
+                         timeout=settings.API_CLIENT_TIMESTAMP_THRESHOLD * 2)
+
 
 class Client(models.Model):
     """
@@ -32,7 +42,16 @@ class Client(models.Model):
         """
         if not self.is_active:
             return False
-        return self.permissions.filter(codename=perm).exists()
+        return perm in self.get_perm_codenames()
+
+    def get_perm_codenames(self):
+        """
+        Returns a set of permission codenames of the client. The result is kept on the instance, so it's cached
+        along with the client.
+        """
+        if not hasattr(self, '_perm_cache'):
+            self._perm_cache = frozenset(self.permissions.values_list('codename', flat=True))
+        return self._perm_cache
 
     def verify_secret(self, hashed_secret, timestamp, raise_exception=False):
         """
@@ -50,9 +69,37 @@ class Client(models.Model):
             else:
                 return False
 
-        # Compute a SHA256 hash of client secret with the timestamp value and securely compare with given hash value
-        verified = compare_digest(hashed_secret,
-                                  sha256(self.secret.encode('utf8') + timestamp.encode('utf8')).hexdigest())
-        if not verified and raise_exception:
-            raise ValueError('Secret does not match')
-        return verified
+        # Securely compare a SHA256 hash of client secret with the timestamp value with given hash value
+        verified = compare_digest(hashed_secret, self._signature(timestamp))
+        if not verified:
+            if raise_exception:
+                raise ValueError('Secret does not match')
+            return False
+
+        # Optionally allow every signature to be used only once within the threshold
+        if settings.API_CLIENT_REPLAY_PROTECTION and not self._use_nonce(hashed_secret):
+            if raise_exception:
+                raise ValueError('Secret was already used')
+            return False
+        return True
+
+    def _signature(self, timestamp):
+        """
+        Returns SHA256 hash of client secret with the `timestamp`. Repeated requests with the same signed URL get it
+        from an in-process cache.
+        """
+        key = (self.pk, timestamp)
+        cached = _signatures.get(key)
+        # Secret is a part of the value, so that a changed secret never matches an old signature
+        if cached is not None and cached[0] == self.secret:
+            return cached[1]
+        signature = sha256(self.secret.encode('utf8') + timestamp.encode('utf8')).hexdigest()
+        _signatures.set(key, (self.secret, signature))
+        return signature
+
+    def _use_nonce(self, hashed_secret):
+        """
+        Records the signature as used in the shared cache. Returns `False` if it was used already.
+        """
+        return cache.add(NONCE_CACHE_KEY.format(self.pk, hashed_secret), True,
+                         settings.API_CLIENT_TIMESTAMP_THRESHOLD * 2)
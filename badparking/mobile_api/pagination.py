@@ -0,0 +1,128 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework import pagination, response, exceptions
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    Keyset (a.k.a. seek) pagination over a `(timestamp, pk)` pair.
+
+    Unlike offset pagination every page is a single index range scan no matter how deep the client has paged, and
+    rows inserted or removed between requests never shift the page boundaries. The position is passed around as
+    an opaque URL-safe cursor encoding the last seen timestamp and primary key.
+
+    `ordering` is a pair of field names, the timestamp field first and the unique tie breaker second, both either
+    ascending or descending.
+    """
+    ordering = ('-created_at', '-pk')
+    cursor_query_param = 'cursor'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.position = self.decode_cursor(request, queryset.model)
+
+        queryset = queryset.order_by(*self.ordering)
+        if self.position is not None:
+            queryset = queryset.filter(self._seek_filter(self.position))
+
+        # Fetch one extra row to find out whether there is a next page without issuing a COUNT
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return response.Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.get_position(self.page[-1])))
+
+    def get_position(self, obj):
+        timestamp_field, pk_field = (field.lstrip('-') for field in self.ordering)
+        return getattr(obj, timestamp_field), getattr(obj, pk_field)
+
+    def encode_cursor(self, position):
+        timestamp, pk = position
+        raw = '{}|{}'.format(timestamp.isoformat(), pk)
+        return urlsafe_b64encode(raw.encode('utf8')).decode('ascii')
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = urlsafe_b64decode(encoded.encode('ascii')).decode('utf8')
+            timestamp, pk = raw.split('|', 1)
+            timestamp = parse_datetime(timestamp)
+            # Convert the primary key now, invalid values would only fail once the query is compiled
+            pk = self._pk_field(model).to_python(pk)
+        except (TypeError, ValueError, ValidationError):
+            raise exceptions.NotFound(self.invalid_cursor_message)
+        if timestamp is None or not pk:
+            raise exceptions.NotFound(self.invalid_cursor_message)
+        return timestamp, pk
+
+    def _pk_field(self, model):
+        name = self.ordering[1].lstrip('-')
+        return model._meta.pk if name == 'pk' else model._meta.get_field(name)
+
+    def _seek_filter(self, position):
+        timestamp, pk = position
+        timestamp_field, pk_field = (field.lstrip('-') for field in self.ordering)
+        lookup = 'lt' if self.ordering[0].startswith('-') else 'gt'
+        return (Q(**{'{}__{}'.format(timestamp_field, lookup): timestamp}) |
+                Q(**{timestamp_field: timestamp, '{}__{}'.format(pk_field, lookup): pk}))
+
+
+class ClaimCursorPagination(KeysetPagination):
+    """
+    Newest first pagination of the claims feed.
+    """
+    ordering = ('-created_at', '-pk')
+
+
+class ClaimChangesPagination(KeysetPagination):
+    """
+    Oldest change first pagination of the claims delta feed.
+
+    The cursor is exposed to the clients as a `watermark`: it is passed in the `since` parameter and the response
+    carries the next one to be stored by the client. When nothing has changed the given watermark is returned back.
+    """
+    ordering = ('modified_at', 'pk')
+    cursor_query_param = 'since'
+
+    def get_paginated_response(self, data):
+        if self.page:
+            watermark = self.encode_cursor(self.get_position(self.page[-1]))
+        else:
+            watermark = self.request.query_params.get(self.cursor_query_param) or None
+        return response.Response(OrderedDict([
+            ('watermark', watermark),
+            ('has_more', self.has_next),
+            ('results', data),
+        ]))
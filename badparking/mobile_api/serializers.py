@@ -2,7 +2,7 @@ from django.conf import settings
 from django.utils import timezone
 from rest_framework import serializers
 
-from core.models import CrimeType, Claim, ClaimState
+from core.models import CrimeType, Claim, ClaimState, ClaimMediaUpload
 from media.models import MediaFileModel
 from profiles.serializers import UserSerializer
 from profiles.jwt import jwt_from_user
@@ -19,10 +19,11 @@ class CrimeTypeSerializer(serializers.ModelSerializer):
 class MediaFileSerializer(serializers.ModelSerializer):
     # Specifying this explicitly as DRF doesn't have a mapping for ImageKit, thus unaware it should grab the URL
     thumbnail = serializers.ImageField(read_only=True)
+    size = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = MediaFileModel
-        fields = ('file', 'thumbnail', 'original_filename')
+        fields = ('file', 'thumbnail', 'original_filename', 'size', 'width', 'height', 'mime_type')
         extra_kwargs = {
             'original_filename': {'write_only': True, 'required': False}
         }
@@ -32,6 +33,17 @@ class MediaFileSerializer(serializers.ModelSerializer):
         return super(MediaFileSerializer, self).create(validated_data)
 
 
+class ClaimMediaUploadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ClaimMediaUpload
+        fields = ('id', 'original_filename', 'size', 'offset')
+
+    def validate_size(self, value):
+        if not 0 < value <= settings.MEDIA_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError('Size must be from 1 to {} bytes'.format(settings.MEDIA_UPLOAD_MAX_SIZE))
+        return value
+
+
 class ClaimStateSerializer(serializers.ModelSerializer):
     class Meta:
         model = ClaimState
@@ -98,4 +110,5 @@ class FacebookAuthUserSerializer(UserSerializer):
         fields = UserSerializer.Meta.fields + ('token',)
 
     def get_token(self, obj):
-        return jwt_from_user(obj)
+        client = self.context.get('client')
+        return jwt_from_user(obj, client.pk if client else None)
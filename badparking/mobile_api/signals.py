@@ -0,0 +1,42 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from profiles.tokens import revoke_clients
+
+from .models import Client
+from .cache import invalidate_client
+
+
+def _invalidate(client_id):
+    invalidate_client(client_id)
+    # Drop again once committed, otherwise a concurrent request could cache the old state in between
+    transaction.on_commit(lambda: invalidate_client(client_id))
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+def client_changed(sender, instance, **kwargs):
+    _invalidate(instance.pk)
+
+
+@receiver(post_save, sender=Client)
+def client_deactivated(sender, instance, **kwargs):
+    if not instance.is_active:
+        revoke_clients([instance.pk])
+
+
+@receiver(m2m_changed, sender=Client.permissions.through)
+def client_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        _invalidate(instance.pk)
+    elif pk_set:
+        # Permission side of the relation, `pk_set` holds the affected clients
+        for client_id in pk_set:
+            _invalidate(client_id)
+    else:
+        # Permission was cleared of all clients
+        for client_id in Client.objects.values_list('pk', flat=True):
+            _invalidate(client_id)
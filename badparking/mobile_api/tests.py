@@ -1,3 +1,456 @@
-from django.test import TestCase
+import os
+import time
+import json
+import shutil
+import tempfile
 
-# Create your tests here.
+from io import BytesIO
+from datetime import timedelta
+from hashlib import sha256
+from unittest.mock import patch
+from threading import Thread
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.files.base import ContentFile
+from PIL import Image
+
+from core.models import Claim, CrimeType, ClaimMediaUpload
+from core.constants import CLAIM_STATUS_CANCELED, CLAIM_STATUS_COMPLETE
+from media.models import MediaFileModel
+from media.thumbnails import ThreadPoolBackend
+from profiles.jwt import jwt_from_user
+from profiles.tokens import REVOKED_CLIENT_KEY
+from profiles.constants import FACEBOOK
+
+from .models import Client
+from .views import ClaimChangesView
+from .cache import get_active_client, invalidate_client
+
+
+User = get_user_model()
+
+
+class ClientAPITestCase(TestCase):
+    fixtures = ['test-data']
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.api_client = Client.objects.get(id='9a6291c1-ef6d-4d81-b6dd-a1699b4b78f0')
+        cls.api_client.permissions.add(Permission.objects.get(codename='can_list_all_claims'))
+        cls.user = User.objects.get(username='a9c598d399c647d18054dc70eb89b4')
+
+    def setUp(self):
+        # Cached clients outlive the rolled back test transactions
+        invalidate_client(self.api_client.pk)
+
+    def _make_api_creds(self, api_client=None, timestamp=None):
+        api_client = api_client or self.api_client
+        if timestamp is None:
+            timestamp = str(int(time.time()))
+        secret_hash = sha256(api_client.secret.encode('utf8') + timestamp.encode('utf8')).hexdigest()
+        return {'client_id': api_client.id, 'client_secret': secret_hash, 'timestamp': timestamp}
+
+    def _create_claims(self, count, **kwargs):
+        data = {
+            'license_plates': 'АА1111АБ',
+            'longitude': '30.379921',
+            'latitude': '50.377243',
+            'city': 'Київ',
+            'address': 'вул. Жулянська, 1',
+            'user': self.user
+        }
+        data.update(kwargs)
+        return [Claim.objects.create(**data) for _ in range(count)]
+
+    def assertConstantQueries(self, request, sizes=(1, 5)):
+        """
+        Asserts that `request` issues the same number of queries no matter how many fully populated claims there
+        are. Claims are added between the calls, so `request` has to list them all on a single page. Claims added
+        for each call have one more media than the ones before.
+        """
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        crimetype = CrimeType.objects.create(name='Test crime type', enabled=True)
+        content = BytesIO()
+        Image.new('RGB', (40, 30), 'red').save(content, 'JPEG')
+        counts = []
+        created = 0
+        with override_settings(MEDIA_ROOT=media_root), patch.object(ThreadPoolBackend, 'schedule_generation'):
+            for media_count, size in enumerate(sizes, 1):
+                for claim in self._create_claims(size - created):
+                    claim.crimetypes.add(crimetype)
+                    claim.log_state(CLAIM_STATUS_CANCELED)
+                    for _ in range(media_count):
+                        claim.attach_media(MediaFileModel.objects.create(
+                            file=ContentFile(content.getvalue(), name='photo.jpg'), original_filename='photo.jpg'))
+                created = size
+                with CaptureQueriesContext(connection) as context:
+                    response = request()
+                self.assertEqual(response.status_code, 200)
+                counts.append(len(context.captured_queries))
+        self.assertEqual(len(set(counts)), 1, 'Query counts differ by number of claims: {}'.format(counts))
+
+
+class ClaimListPaginationTests(ClientAPITestCase):
+    def test_pages_cover_all_claims_newest_first(self):
+        claims = self._create_claims(5)
+        expected = [str(c.pk) for c in sorted(claims, key=lambda c: (c.created_at, str(c.pk)), reverse=True)]
+
+        params = self._make_api_creds()
+        params['page_size'] = 2
+        response = self.client.get('/api/v1/claims', params)
+        seen = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen.extend(c['pk'] for c in response.data['results'])
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+
+        self.assertEqual(seen, expected)
+
+    def test_page_size_is_bounded(self):
+        self._create_claims(3)
+        params = self._make_api_creds()
+        params['page_size'] = 100000
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/claims', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 3)
+        # The page is clamped to `max_page_size`, one extra row is fetched to detect the next page
+        self.assertTrue(any('LIMIT 501' in query['sql'] for query in queries.captured_queries))
+
+    def test_invalid_cursor(self):
+        params = self._make_api_creds()
+        for cursor in ('garbage', 'MjAxNi0xMC0wNlQwMDowMDowMCswMDowMHxub3QtYS11dWlk'):
+            params['cursor'] = cursor
+            response = self.client.get('/api/v1/claims', params)
+            self.assertEqual(response.status_code, 404)
+
+
+@patch.object(ClaimChangesView, 'settle_delay', timedelta(0))
+class ClaimChangesTests(ClientAPITestCase):
+    def _poll(self, since=None):
+        params = self._make_api_creds()
+        if since:
+            params['since'] = since
+        response = self.client.get('/api/v1/claims/changes', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_incremental_sync(self):
+        claims = self._create_claims(3)
+        data = self._poll()
+        self.assertEqual([c['pk'] for c in data['results']], [str(c.pk) for c in claims])
+        self.assertFalse(data['has_more'])
+
+        # Nothing changed since, watermark stays
+        watermark = data['watermark']
+        data = self._poll(watermark)
+        self.assertEqual(data['results'], [])
+        self.assertEqual(data['watermark'], watermark)
+
+        # Status change is picked up
+        claims[1].log_state(CLAIM_STATUS_CANCELED)
+        data = self._poll(watermark)
+        self.assertEqual([c['pk'] for c in data['results']], [str(claims[1].pk)])
+        self.assertEqual(data['results'][0]['status'], CLAIM_STATUS_CANCELED)
+        self.assertNotEqual(data['watermark'], watermark)
+
+    def test_relation_changes(self):
+        claims = self._create_claims(2)
+        watermark = self._poll()['watermark']
+
+        claims[0].crimetypes.add(CrimeType.objects.create(name='1', enabled=True))
+        with patch.object(ThreadPoolBackend, 'schedule_generation'):
+            claims[1].attach_media(MediaFileModel.objects.create(file='images/photo.jpg',
+                                                                 original_filename='photo.jpg'))
+            data = self._poll(watermark)
+        self.assertEqual([c['pk'] for c in data['results']], [str(c.pk) for c in claims])
+
+    def test_unsettled_changes_are_held_back(self):
+        self._create_claims(2)
+        with patch.object(ClaimChangesView, 'settle_delay', timedelta(minutes=1)):
+            data = self._poll()
+        self.assertEqual(data['results'], [])
+        self.assertIsNone(data['watermark'])
+
+
+class ClaimFilterTests(ClientAPITestCase):
+    def test_crimetypes_filter(self):
+        first, second, third = (CrimeType.objects.create(name=name, enabled=True) for name in ('1', '2', '3'))
+        first_claim, second_claim, _ = self._create_claims(3)
+        first_claim.crimetypes.add(first)
+        second_claim.crimetypes.add(second, third)
+
+        params = self._make_api_creds()
+        params['crimetypes'] = [first.pk, third.pk]
+        response = self.client.get('/api/v1/claims', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({c['pk'] for c in response.data['results']}, {str(first_claim.pk), str(second_claim.pk)})
+
+        params['crimetypes'] = [second.pk]
+        response = self.client.get('/api/v1/claims', params)
+        self.assertEqual([c['pk'] for c in response.data['results']], [str(second_claim.pk)])
+
+
+class ClaimQueryCountTests(ClientAPITestCase):
+    def test_claim_list(self):
+        self.assertConstantQueries(lambda: self.client.get('/api/v1/claims', self._make_api_creds()))
+
+    def test_claim_changes(self):
+        with patch.object(ClaimChangesView, 'settle_delay', timedelta(0)):
+            self.assertConstantQueries(lambda: self.client.get('/api/v1/claims/changes', self._make_api_creds()))
+
+    def test_current_user_claims(self):
+        auth = 'JWT {}'.format(jwt_from_user(self.user))
+        self.assertConstantQueries(lambda: self.client.get('/api/v1/claims/my', HTTP_AUTHORIZATION=auth))
+
+
+class ClientCacheTests(ClientAPITestCase):
+    def test_cached_client_permissions(self):
+        get_active_client(self.api_client.pk)
+        with self.assertNumQueries(0):
+            client = get_active_client(str(self.api_client.pk))
+            self.assertTrue(client.has_perm('can_list_all_claims'))
+            self.assertFalse(client.has_perm('add_claim'))
+
+    def test_permission_change_invalidates(self):
+        self.assertTrue(get_active_client(self.api_client.pk).has_perm('can_list_all_claims'))
+        self.api_client.permissions.clear()
+        self.assertFalse(get_active_client(self.api_client.pk).has_perm('can_list_all_claims'))
+
+        response = self.client.get('/api/v1/claims', self._make_api_creds())
+        self.assertEqual(response.status_code, 403)
+
+    def test_deactivation_invalidates(self):
+        # Deactivation also revokes tokens issued through the client
+        self.addCleanup(cache.delete, REVOKED_CLIENT_KEY.format(self.api_client.pk))
+        get_active_client(self.api_client.pk)
+        self.api_client.is_active = False
+        self.api_client.save()
+        with self.assertRaises(Client.DoesNotExist):
+            get_active_client(self.api_client.pk)
+
+    def test_invalid_client_id(self):
+        with self.assertRaises(Client.DoesNotExist):
+            get_active_client('dummy')
+
+
+class ClientSignatureTests(ClientAPITestCase):
+    def setUp(self):
+        super(ClientSignatureTests, self).setUp()
+        # Fresh instance, as the tests change the secret in memory
+        self.signing_client = Client.objects.get(pk=self.api_client.pk)
+
+    def test_repeated_signature_is_not_rehashed(self):
+        creds = self._make_api_creds(self.signing_client)
+        self.assertTrue(self.signing_client.verify_secret(creds['client_secret'], creds['timestamp']))
+        with patch('mobile_api.models.sha256') as mock_sha256:
+            self.assertTrue(self.signing_client.verify_secret(creds['client_secret'], creds['timestamp']))
+            self.assertFalse(self.signing_client.verify_secret('0' * 64, creds['timestamp']))
+            mock_sha256.assert_not_called()
+
+    def test_changed_secret(self):
+        creds = self._make_api_creds(self.signing_client)
+        self.assertTrue(self.signing_client.verify_secret(creds['client_secret'], creds['timestamp']))
+        self.signing_client.secret = 'changed'
+        self.assertFalse(self.signing_client.verify_secret(creds['client_secret'], creds['timestamp']))
+
+    @override_settings(API_CLIENT_REPLAY_PROTECTION=True)
+    def test_replay_protection(self):
+        # Unique secret, so that nonces recorded by previous runs don't interfere
+        self.signing_client.secret = 'replay-{}'.format(time.time())
+        creds = self._make_api_creds(self.signing_client)
+        self.assertTrue(self.signing_client.verify_secret(creds['client_secret'], creds['timestamp']))
+        self.assertFalse(self.signing_client.verify_secret(creds['client_secret'], creds['timestamp']))
+        with self.assertRaises(ValueError):
+            self.signing_client.verify_secret(creds['client_secret'], creds['timestamp'], raise_exception=True)
+
+
+@patch.object(ThreadPoolBackend, 'schedule_generation')
+class ResumableUploadTests(ClientAPITestCase):
+    def setUp(self):
+        super(ResumableUploadTests, self).setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root,
+                                              MEDIA_UPLOAD_TEMP_DIR=os.path.join(media_root, 'uploads'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.auth = 'JWT {}'.format(jwt_from_user(self.user))
+        self.claim = self._create_claims(1, media_filenames=['photo.jpg'])[0]
+        content = BytesIO()
+        Image.new('RGB', (200, 100), 'blue').save(content, 'JPEG')
+        self.content = content.getvalue()
+
+    def _initiate(self):
+        response = self.client.post('/api/v1/claims/my/{}/uploads'.format(self.claim.pk),
+                                    {'original_filename': 'photo.jpg', 'size': len(self.content)},
+                                    HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(response.status_code, 201)
+        return '/api/v1/claims/my/{}/uploads/{}'.format(self.claim.pk, response.data['id'])
+
+    def _put(self, url, first, last):
+        return self.client.put(url, self.content[first:last + 1], content_type='application/octet-stream',
+                               HTTP_AUTHORIZATION=self.auth,
+                               HTTP_CONTENT_RANGE='bytes {}-{}/{}'.format(first, last, len(self.content)))
+
+    def test_resumed_upload(self, schedule_generation):
+        url = self._initiate()
+        half = len(self.content) // 2
+        self.assertEqual(self._put(url, 0, half - 1).data['offset'], half)
+
+        # Gap after the received bytes
+        response = self._put(url, half + 10, len(self.content) - 1)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['offset'], half)
+
+        response = self.client.post(url + '/complete', HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(response.status_code, 409)
+
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=self.auth).data['offset'], half)
+        # Retried range overlapping the received bytes
+        self.assertEqual(self._put(url, half - 10, len(self.content) - 1).data['offset'], len(self.content))
+
+        response = self.client.post(url + '/complete', HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(response.status_code, 201)
+        claim = Claim.objects.get(pk=self.claim.pk)
+        self.assertEqual(claim.status, CLAIM_STATUS_COMPLETE)
+        self.assertEqual([m.original_filename for m in claim.media.all()], ['photo.jpg'])
+        self.assertFalse(ClaimMediaUpload.objects.exists())
+        self.assertEqual(os.listdir(settings.MEDIA_UPLOAD_TEMP_DIR), [])
+
+    def test_invalid_range(self, schedule_generation):
+        url = self._initiate()
+        response = self.client.put(url, self.content, content_type='application/octet-stream',
+                                   HTTP_AUTHORIZATION=self.auth, HTTP_CONTENT_RANGE='bytes 0-10/1')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(url[:-4] + '0000', HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(response.status_code, 404)
+
+
+class FakeGraphServer(ThreadingMixIn, HTTPServer):
+    """
+    Local stand-in for the Facebook Graph API.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super(FakeGraphServer, self).__init__(('127.0.0.1', 0), FakeGraphHandler)
+        self.users = {}  # Access token to user info dict
+        self.failures = 0  # Number of requests to fail before responding
+        self.delay = 0  # Seconds to wait before responding
+        self.requests = []  # Path, query and client address of each request
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address)
+
+    def handle_error(self, request, client_address):
+        # Clients timing out close the connection before the response is written
+        pass
+
+
+class FakeGraphHandler(BaseHTTPRequestHandler):
+    # Keep connections alive
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        self.server.requests.append((url.path, query, self.client_address))
+        time.sleep(self.server.delay)
+        if self.server.failures:
+            self.server.failures -= 1
+            self._respond(503, {'error': {'message': 'Service unavailable', 'type': 'FacebookApiException'}})
+        elif url.path != '/v2.7/me':
+            self._respond(404, {'error': {'message': 'Unknown path', 'type': 'GraphMethodException'}})
+        elif query.get('access_token', [None])[0] in self.server.users:
+            self._respond(200, self.server.users[query['access_token'][0]])
+        else:
+            self._respond(400, {'error': {'message': 'Invalid OAuth access token', 'type': 'OAuthException',
+                                          'code': 190}})
+
+    def _respond(self, status, data):
+        body = json.dumps(data).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FacebookAuthTests(ClientAPITestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(FacebookAuthTests, cls).setUpClass()
+        cls.graph = FakeGraphServer()
+        Thread(target=cls.graph.serve_forever, daemon=True).start()
+        cls.graph_settings = override_settings(FACEBOOK_API_URL=cls.graph.url, FACEBOOK_API_TIMEOUT=(1, 0.2))
+        cls.graph_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.graph_settings.disable()
+        cls.graph.shutdown()
+        cls.graph.server_close()
+        super(FacebookAuthTests, cls).tearDownClass()
+
+    def setUp(self):
+        super(FacebookAuthTests, self).setUp()
+        self.graph.users = {'valid': {'id': '1234567890', 'first_name': 'Eugene', 'last_name': 'Salo',
+                                      'email': 'eugene.salo@email.com'}}
+        self.graph.failures = 0
+        self.graph.delay = 0
+        self.graph.requests = []
+
+    def _auth(self, access_token):
+        creds = self._make_api_creds()
+        return self.client.post('/api/v1/user/auth/facebook?client_id={client_id}&client_secret={client_secret}'
+                                '&timestamp={timestamp}'.format(**creds), {'access_token': access_token})
+
+    def test_auth(self):
+        response = self._auth('valid')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.data['token'])
+        user = User.objects.get(external_id='1234567890')
+        self.assertEqual(user.provider_type, FACEBOOK)
+
+        self.assertEqual(self._auth('valid').status_code, 200)
+        # Both logins are served over a single kept alive connection
+        self.assertEqual(len({address for _, _, address in self.graph.requests}), 1)
+
+    def test_invalid_token(self):
+        self.assertEqual(self._auth('invalid').status_code, 401)
+        # Graph API errors are not retried
+        self.assertEqual(len(self.graph.requests), 1)
+
+    def test_retry(self):
+        self.graph.failures = 1
+        self.assertEqual(self._auth('valid').status_code, 201)
+        self.assertEqual(len(self.graph.requests), 2)
+
+    def test_unavailable(self):
+        self.graph.failures = 10
+        self.assertEqual(self._auth('valid').status_code, 503)
+        self.assertEqual(len(self.graph.requests), settings.FACEBOOK_API_RETRIES + 1)
+
+    def test_timeout(self):
+        self.graph.delay = 0.5
+        self.assertEqual(self._auth('valid').status_code, 503)
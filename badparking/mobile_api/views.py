@@ -1,6 +1,9 @@
+import re
 import logging
 import facepy
 
+from datetime import timedelta
+
 from django.db import transaction
 from django.contrib.auth import get_user_model
 from django.utils import timezone
@@ -8,18 +11,24 @@ from django.conf import settings
 
 from rest_framework import viewsets, permissions, response, generics, exceptions, mixins, status
 from rest_framework.decorators import detail_route
+from rest_framework_jwt.views import RefreshJSONWebToken, VerifyJSONWebToken
 
-from core.models import CrimeType, Claim
+from core.models import CrimeType, Claim, ClaimMediaUpload
 from profiles.constants import FACEBOOK
-from profiles.serializers import UserSerializer
+from profiles.serializers import UserSerializer, RefreshTokenSerializer, VerifyTokenSerializer
 from .serializers import ClaimSerializer, CrimeTypeSerializer, UserCompleteSerializer, FacebookAuthUserSerializer,\
-    MediaFileSerializer, ClaimReadSerializer
+    MediaFileSerializer, ClaimReadSerializer, ClaimMediaUploadSerializer
 from .mixins import ClientAuthMixin, UserObjectMixin
+from .facebook import GraphAPI
+from .pagination import ClaimCursorPagination, ClaimChangesPagination
+from .filters import ClaimFilter
 
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
 
 class CrimeTypeViewSet(viewsets.ReadOnlyModelViewSet):
     """
@@ -30,6 +39,22 @@ class CrimeTypeViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = (permissions.AllowAny,)
 
 
+class RefreshTokenView(RefreshJSONWebToken):
+    """
+    Refresh a token, returning the next one of its family.
+
+    Every token may be refreshed only once, refreshing it again revokes all the tokens of the family.
+    """
+    serializer_class = RefreshTokenSerializer
+
+
+class VerifyTokenView(VerifyJSONWebToken):
+    """
+    Verify a token, which must not be expired nor revoked.
+    """
+    serializer_class = VerifyTokenSerializer
+
+
 class CurrentUserView(UserObjectMixin, generics.RetrieveAPIView):
     """
     Retrieve current authenticated user info.
@@ -88,22 +113,27 @@ class FacebookAuthUserView(ClientAuthMixin, generics.GenericAPIView):
               message: Matching user found and authenticated
             - code: 401
               message: Authentication failed
+            - code: 503
+              message: Facebook is unavailable or did not respond in time
         """
         access_token = request.POST.get('access_token')
         if not access_token:
             raise exceptions.ValidationError('Facebook access_token is missing')
 
-        self._get_client(request)
+        self.client = self._get_client(request)
 
         try:
-            graph = facepy.GraphAPI(access_token, version=self.FACEBOOK_API_VERSION,
-                                    appsecret=settings.FACEBOOK_APP_SECRET)
+            graph = GraphAPI(access_token, version=self.FACEBOOK_API_VERSION, appsecret=settings.FACEBOOK_APP_SECRET)
             user_info = graph.get('me', fields=self.FACEBOOK_USER_FIELDS)
         except facepy.OAuthError:
             raise exceptions.AuthenticationFailed()
         except facepy.FacebookError as exc:
             logger.exception(exc.message, extra={'request': request})
             raise exceptions.ValidationError('Facebook access token error')
+        except facepy.HTTPError:
+            logger.exception('Facebook Graph API request failed', extra={'request': request})
+            return response.Response({'detail': 'Facebook is unavailable'},
+                                     status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
         user_info = self._map_user_info(user_info)
         try:
@@ -118,6 +148,11 @@ class FacebookAuthUserView(ClientAuthMixin, generics.GenericAPIView):
 
         return response.Response(serializer.data, status=http_status)
 
+    def get_serializer_context(self):
+        context = super(FacebookAuthUserView, self).get_serializer_context()
+        context['client'] = self.client
+        return context
+
     def _map_user_info(self, user_info):
         data = {
             'external_id': user_info['id'],
@@ -132,10 +167,13 @@ class FacebookAuthUserView(ClientAuthMixin, generics.GenericAPIView):
 
 
 class ClaimListView(ClientAuthMixin, generics.ListCreateAPIView):
-    queryset = Claim.objects.authorized()
     serializer_class = ClaimSerializer
     permission_classes = (permissions.AllowAny,)
-    filter_fields = ('status', 'crimetypes', 'city', 'created_at')
+    filter_class = ClaimFilter
+    pagination_class = ClaimCursorPagination
+
+    def get_queryset(self):
+        return Claim.objects.authorized().with_related()
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -147,6 +185,9 @@ class ClaimListView(ClientAuthMixin, generics.ListCreateAPIView):
         """
         Retrieve a list of all claims, optionally filtered by `status`, `crimetypes`, `city` and `created_at`.
 
+        Claims are returned newest first in pages. The `next` link of the response contains an opaque `cursor` for
+        the following page and is `null` on the last one.
+
         Doesn't need user authentication but requires providing client id and secret pair for an API client, which
         has a "can_list_all_claims" permission.
         ---
@@ -166,6 +207,16 @@ class ClaimListView(ClientAuthMixin, generics.ListCreateAPIView):
               required: true
               type: integer
               paramType: query
+            - name: cursor
+              description: Opaque position of the page as returned in the `next` link
+              required: false
+              type: string
+              paramType: query
+            - name: page_size
+              description: Number of claims per page, 100 by default and 500 at most
+              required: false
+              type: integer
+              paramType: query
         """
         client = self._get_client(request)
 
@@ -199,10 +250,68 @@ class ClaimListView(ClientAuthMixin, generics.ListCreateAPIView):
               type: integer
               paramType: query
         """
-        self._get_client(request)
+        self.client = self._get_client(request)
         return super(ClaimListView, self).post(request, *args, **kwargs)
 
 
+class ClaimChangesView(ClientAuthMixin, generics.ListAPIView):
+    serializer_class = ClaimReadSerializer
+    permission_classes = (permissions.AllowAny,)
+    filter_class = ClaimFilter
+    pagination_class = ClaimChangesPagination
+    # Changes younger than this are held back, so that transactions started earlier but committed later than
+    # a served page can't end up behind the issued watermark
+    settle_delay = timedelta(seconds=5)
+
+    def get_queryset(self):
+        return Claim.objects.authorized().filter(modified_at__lte=timezone.now() - self.settle_delay).with_related()
+
+    def get(self, request, *args, **kwargs):
+        """
+        Retrieve claims created or changed since the given watermark, oldest change first.
+
+        A claim is considered changed whenever any of its fields or its status is updated, as logging a new state
+        also bumps `modified_at` of the claim. Start without `since` to get everything and then pass `watermark` of
+        the previous response on the next poll. If `has_more` is true the next page is available right away.
+
+        Doesn't need user authentication but requires providing client id and secret pair for an API client, which
+        has a "can_list_all_claims" permission.
+        ---
+        parameters:
+            - name: client_id
+              description: ID of the API Client
+              required: true
+              type: string
+              paramType: query
+            - name: client_secret
+              description: Secret of the API Client hashed with a timestamp as `SHA256(secret + timestamp)`
+              required: true
+              type: string
+              paramType: query
+            - name: timestamp
+              description: Current UTC timestamp value in seconds used for hashing the `client_secret`
+              required: true
+              type: integer
+              paramType: query
+            - name: since
+              description: Watermark returned by the previous request
+              required: false
+              type: string
+              paramType: query
+            - name: page_size
+              description: Number of claims per page, 100 by default and 500 at most
+              required: false
+              type: integer
+              paramType: query
+        """
+        client = self._get_client(request)
+
+        if not client.has_perm('can_list_all_claims'):
+            raise exceptions.PermissionDenied()
+
+        return super(ClaimChangesView, self).get(request, *args, **kwargs)
+
+
 class ClaimAuthorizeView(generics.GenericAPIView):
     queryset = Claim.objects.unauthorized()
     serializer_class = ClaimSerializer
@@ -236,10 +345,11 @@ class CurrentUserClaimViewSet(mixins.CreateModelMixin,
     Filtering by `status`, `crimetypes`, `city` and `created_at` is possible.
     """
     serializer_class = ClaimSerializer
-    filter_fields = ('status', 'crimetypes', 'city', 'created_at')
+    filter_class = ClaimFilter
 
     def get_queryset(self):
-        return self.request.user.claims.all()
+        # Filter by the ID, so that the user is not loaded
+        return Claim.objects.filter(user_id=self.request.user.pk).with_related()
 
     @detail_route(methods=['post'])
     def cancel(self, request, pk=None):
@@ -252,8 +362,7 @@ class CurrentUserClaimViewSet(mixins.CreateModelMixin,
         omit_serializer: true
         """
         claim = self.get_object()
-        if claim.is_cancelable():
-            claim.try_cancel()
+        if claim.try_cancel():
             return response.Response({'status': claim.status})
         else:
             raise exceptions.ValidationError('This claim can not be canceled')
@@ -277,6 +386,87 @@ class CurrentUserClaimViewSet(mixins.CreateModelMixin,
         serializer.is_valid(raise_exception=True)
         with transaction.atomic():
             media = serializer.save()
-            claim.media.add(media)
+            claim.attach_media(media)
             claim.try_complete()
         return response.Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @detail_route(methods=['post'], serializer_class=ClaimMediaUploadSerializer)
+    def uploads(self, request, pk=None):
+        """
+        Start a resumable upload of a media file for a claim provided by ID.
+
+        The file is then sent in byte ranges by `PUT` requests to `uploads/<id>` with a `Content-Range: bytes
+        <first>-<last>/<size>` header and raw bytes in the body. A range may repeat the already received bytes,
+        `GET` on the same URL returns the received `offset` to resume from after a failure. Once all the bytes are
+        received, `POST` to `uploads/<id>/complete` attaches the file to the claim just like the `media` endpoint.
+        Requires user authentication (provided claim must belong to the user).
+        ---
+        serializer: ClaimMediaUploadSerializer
+        """
+        claim = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(claim=claim)
+        return response.Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @detail_route(methods=['get', 'put'], url_path=r'uploads/(?P<upload_id>[\w\d-]+)',
+                  serializer_class=ClaimMediaUploadSerializer)
+    def upload(self, request, pk=None, upload_id=None):
+        """
+        Get the state of a resumable upload or send a byte range of it.
+
+        Ranges not continuing the received bytes are rejected with 409 and the current `offset`.
+        ---
+        serializer: ClaimMediaUploadSerializer
+        omit_parameters:
+            - form
+        """
+        upload = self._get_upload(upload_id)
+        if request.method == 'PUT':
+            match = CONTENT_RANGE_RE.match(request.META.get('HTTP_CONTENT_RANGE', ''))
+            if not match:
+                raise exceptions.ValidationError('Content-Range header is missing or invalid')
+            first, last, size = match.groups()
+            first, last = int(first), int(last)
+            if last < first or (size != '*' and int(size) != upload.size):
+                raise exceptions.ValidationError('Content-Range does not match the upload')
+            try:
+                # Stream the body straight to the disk, `request.data` would buffer it
+                upload.write_chunk(request.stream, first, last - first + 1)
+            except ValueError as exc:
+                return response.Response({'detail': str(exc), 'offset': upload.offset},
+                                         status=status.HTTP_409_CONFLICT)
+        return response.Response(self.get_serializer(upload).data)
+
+    @detail_route(methods=['post'], url_path=r'uploads/(?P<upload_id>[\w\d-]+)/complete',
+                  serializer_class=MediaFileSerializer)
+    def complete_upload(self, request, pk=None, upload_id=None):
+        """
+        Finish a resumable upload and attach the file to the claim.
+        ---
+        serializer: MediaFileSerializer
+        """
+        upload = self._get_upload(upload_id)
+        if not upload.is_finished:
+            return response.Response({'detail': 'Upload is not finished', 'offset': upload.offset},
+                                     status=status.HTTP_409_CONFLICT)
+        with upload.open() as file:
+            serializer = self.get_serializer(data={'file': file})
+            serializer.is_valid(raise_exception=True)
+            with transaction.atomic():
+                media = serializer.save()
+                upload.claim.attach_media(media)
+                upload.claim.try_complete()
+                upload.delete()
+        # Unless the storage has already moved it into place
+        upload.delete_file()
+        return response.Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def _get_upload(self, upload_id):
+        claim = self.get_object()
+        try:
+            upload = claim.uploads.get(pk=upload_id)
+        except (ClaimMediaUpload.DoesNotExist, ValueError):
+            raise exceptions.NotFound()
+        upload.claim = claim
+        return upload
@@ -8,6 +8,9 @@ class ProfilesConfig(AppConfig):
     name = 'profiles'
 
     def ready(self):
+        # Connect signal receivers
+        from . import signals  # noqa
+
         # Load BankID clients once on app load
         if not hasattr(self, 'oschad_bankid'):
             self.oschad_bankid = OschadBankId(**settings.BANKID_OSCHADBANK)
@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.auth import get_user_model
+from django.utils.functional import SimpleLazyObject, empty
+from rest_framework import exceptions
+from rest_framework_jwt.authentication import JSONWebTokenAuthentication
+
+from .tokens import is_revoked
+
+
+USER_CACHE_KEY = 'profiles:user:{}'
+
+
+def get_cached_user(user_id):
+    """
+    Returns an active user by `user_id` from the shared cache or the database.
+    Raises `User.DoesNotExist` if there is no such active user.
+    """
+    key = USER_CACHE_KEY.format(user_id)
+    user = cache.get(key)
+    if user is None:
+        user = get_user_model().objects.get(pk=user_id, is_active=True)
+        cache.set(key, user, settings.PROFILE_USER_CACHE_TIMEOUT)
+    return user
+
+
+def invalidate_user(user_id):
+    cache.delete(USER_CACHE_KEY.format(user_id))
+
+
+class TokenUser(SimpleLazyObject):
+    """
+    User known from a verified JWT payload. Identity and profile completion are answered from the payload, any other
+    attribute loads the actual user, from the cache first.
+    """
+    def __init__(self, payload):
+        self.__dict__['_payload'] = payload
+        super(TokenUser, self).__init__(self._load_user)
+
+    def _load_user(self):
+        try:
+            return get_cached_user(self.pk)
+        except get_user_model().DoesNotExist:
+            raise exceptions.AuthenticationFailed('User account is disabled.')
+
+    @property
+    def pk(self):
+        return self._payload['user_id']
+
+    id = pk
+
+    @property
+    def username(self):
+        return self._payload['username']
+
+    def get_full_name(self):
+        return self._payload['full_name']
+
+    def is_complete(self):
+        # Token issued before the profile was completed is outdated, check the actual user
+        return self._payload['is_complete'] or self._get_user().is_complete()
+
+    def is_authenticated(self):
+        return True
+
+    def is_anonymous(self):
+        return False
+
+    def _get_user(self):
+        if self._wrapped is empty:
+            self._setup()
+        return self._wrapped
+
+    def __bool__(self):
+        return True
+
+
+class JSONWebTokenUserAuthentication(JSONWebTokenAuthentication):
+    """
+    JWT authentication, which doesn't load the user unless a view needs more than the token carries.
+
+    Revoked tokens are rejected, deactivation of a user revokes all their tokens.
+    """
+    def authenticate_credentials(self, payload):
+        if is_revoked(payload):
+            raise exceptions.AuthenticationFailed('Token has been revoked.')
+        if not payload.get('user_id') or 'is_complete' not in payload:
+            # Not issued by `extended_jwt_payload_handler`
+            return super(JSONWebTokenUserAuthentication, self).authenticate_credentials(payload)
+        return TokenUser(payload)
@@ -1,10 +1,16 @@
+import time
+import logging
 import requests
 
 from urllib.parse import urlencode, urljoin
 from collections import namedtuple
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 
 from .exceptions import BankIdError
 
+logger = logging.getLogger(__name__)
+
 Token = namedtuple('Token', ['access_token', 'refresh_token', 'expires_in', 'token_type'])
 
 
@@ -15,8 +21,16 @@ class BaseBankIdClient(object):
     additional arguments. Optionally following keyword arguments may be provided:
         authorization_base_url: URL to be used for authorization grant step
         api_base_url: Base URL for the API requests not related to authorization step
+        timeout: seconds to wait for a connection and then for a response, a single number or a pair of them
+        retries: number of retries of requests failing to connect
+        backoff_factor: base of the exponential delay between the retries
+        pool_size: number of keep-alive connections kept to the provider
+
+    Requests are sent over a single pooled session shared by all the threads. They aren't retried once sent to
+    the provider, even if rejected by an unavailable gateway, as authorization codes and refresh tokens may only be
+    used once. Latency of every request is logged.
 
-    Public methods may raise `BankIdError` exception for specific BankID errors.
+    Public methods may raise `BankIdError` exception for specific BankID errors and failed requests.
     """
 
     default_authorization_base_url = NotImplemented
@@ -28,6 +42,16 @@ class BaseBankIdClient(object):
         self.client_secret = client_secret
         self.authorization_base_url = kwargs.get('authorization_base_url', self.default_authorization_base_url)
         self.api_base_url = kwargs.get('api_base_url', self.default_api_base_url)
+        self.timeout = kwargs.get('timeout', (3.05, 15))
+
+        retries = kwargs.get('retries', 2)
+        backoff_factor = kwargs.get('backoff_factor', 0.2)
+        pool_size = kwargs.get('pool_size', 10)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=Retry(
+            total=retries, connect=retries, read=0, backoff_factor=backoff_factor))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
     def authorization_url(self, redirect_url):
         """
@@ -45,7 +69,7 @@ class BaseBankIdClient(object):
         Returns `Token` instance with OAuth2 access and refresh tokens obtained by the given `code`.
         `redirect_url` MUST match the one used for `authorization_url`.
         """
-        response = requests.post(urljoin(self.api_base_url, self.token_endpoint), data={
+        response = self._post(urljoin(self.api_base_url, self.token_endpoint), data={
             'code': code,
             'client_id': self.client_id,
             'client_secret': self._client_secret(code),
@@ -64,7 +88,7 @@ class BaseBankIdClient(object):
         Note: can be used only once for a new token. Refreshed token does not contain a `refresh_token` anymore.
         """
         assert token.refresh_token is not None
-        response = requests.post(urljoin(self.api_base_url, self.token_endpoint), data={
+        response = self._post(urljoin(self.api_base_url, self.token_endpoint), data={
             'client_id': self.client_id,
             'client_secret': self._client_secret(token.refresh_token),
             'refresh_token': token.refresh_token,
@@ -82,6 +106,19 @@ class BaseBankIdClient(object):
         """
         raise NotImplementedError
 
+    def _post(self, url, **kwargs):
+        started_at = time.monotonic()
+        outcome = 'failed'
+        try:
+            response = self.session.post(url, timeout=self.timeout, **kwargs)
+            outcome = response.status_code
+            return response
+        except requests.RequestException as exc:
+            raise BankIdError(code=None, description='Request failed: {}'.format(exc))
+        finally:
+            logger.info('%s POST %s %s in %.1f ms', self.__class__.__name__, url, outcome,
+                        (time.monotonic() - started_at) * 1000)
+
     def _client_secret(self, code):
         return self.client_secret
 
@@ -19,9 +19,9 @@ class OschadBankId(BaseBankIdClient):
             'Authorization': 'Bearer {}'.format(token.access_token),
             'Accept': 'application/json'
         }
-        response = requests.post(urljoin(self.api_base_url, 'bank/resource/client'),
-                                 json=declaration,
-                                 headers=headers)
+        response = self._post(urljoin(self.api_base_url, 'bank/resource/client'),
+                              json=declaration,
+                              headers=headers)
         if response.status_code == requests.codes.ok:
             return response.json()
         else:
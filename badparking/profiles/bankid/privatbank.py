@@ -3,6 +3,7 @@ import requests
 from hashlib import sha1
 from base64 import b64decode
 from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import padding
@@ -15,7 +16,8 @@ class PrivatBankId(BaseBankIdClient):
     """
     PrivatBank-specific BankID client.
     Note: in addition to usual arguments its constructor also requires `private_key_path`, which points to
-    an absolute path of the private key as approved by the provider.
+    an absolute path of the private key as approved by the provider. Optional `decrypt_workers` keyword argument
+    sets the number of threads decrypting the customer fields.
     """
 
     default_authorization_base_url = 'https://bankid.privatbank.ua/DataAccessService/das/authorize'
@@ -27,14 +29,16 @@ class PrivatBankId(BaseBankIdClient):
         with open(private_key_path, 'rb') as key_file:
             self.private_key = serialization.load_pem_private_key(key_file.read(), password=None,
                                                                   backend=default_backend())
+        # OpenSSL releases the GIL while decrypting, so the fields are decrypted in parallel
+        self.decrypt_executor = ThreadPoolExecutor(max_workers=kwargs.get('decrypt_workers', 4))
 
     def user_info(self, token, declaration):
         headers = {
             'Authorization': 'Bearer {}, Id {}'.format(token.access_token, self.client_id),
             'Accept': 'application/json'
         }
-        response = requests.post(urljoin(self.api_base_url, 'ResourceService/checked/data'),
-                                 json=declaration, headers=headers)
+        response = self._post(urljoin(self.api_base_url, 'ResourceService/checked/data'),
+                              json=declaration, headers=headers)
         if response.status_code == requests.codes.ok:
             data = response.json()
             if data['state'] == 'err':
@@ -42,7 +46,7 @@ class PrivatBankId(BaseBankIdClient):
             elif data['state'] == 'ok':
                 customer = data['customer']
                 if 'signature' in customer:
-                    data['customer'] = self._decrypt(customer)
+                    data['customer'] = self._decrypt(customer, declaration)
                 return data
             else:
                 raise BankIdError(code=None, description='Unknown response state "{}"'.format(data['state']))
@@ -52,15 +56,38 @@ class PrivatBankId(BaseBankIdClient):
     def _client_secret(self, code):
         return sha1(self.client_id.encode('utf8') + self.client_secret.encode('utf8') + code.encode('utf8')).hexdigest()
 
-    def _decrypt(self, user_info):
-        def recursive_decrypt(value):
-            if isinstance(value, list):
-                return [recursive_decrypt(v) for v in value]
-            elif isinstance(value, dict):
-                return {k: (recursive_decrypt(v) if k not in ('type', 'signature') else v) for k, v in value.items()}
-            elif isinstance(value, str):
-                return self.private_key.decrypt(b64decode(value), padding.PKCS1v15()).decode('utf8')
-            else:
-                raise BankIdError(code=None, description='Unexpected value for decryption')
+    def _decrypt(self, customer, declaration):
+        """
+        Returns the customer info with only the fields requested by `declaration` decrypted. Fields and sections,
+        such as addresses or documents, the declaration doesn't ask for are left out instead of being decrypted.
+        """
+        decrypted = {k: v for k, v in customer.items() if k in ('type', 'signature')}
+        leaves = []  # Target dict, field name and encrypted value of each declared field
+
+        def collect(source, target, fields):
+            for field in fields:
+                if field in source:
+                    leaves.append((target, field, source[field]))
+
+        collect(customer, decrypted, declaration.get('fields', ()))
+        for section, declared in declaration.items():
+            if section == 'fields' or not isinstance(declared, list):
+                continue
+            # Sections are declared as lists of entry types with their fields
+            fields_by_type = {entry['type']: entry.get('fields', ()) for entry in declared}
+            decrypted[section] = []
+            for entry in customer.get(section, ()):
+                if entry.get('type') in fields_by_type:
+                    target = {'type': entry['type']}
+                    collect(entry, target, fields_by_type[entry['type']])
+                    decrypted[section].append(target)
+
+        values = self.decrypt_executor.map(self._decrypt_value, [value for _, _, value in leaves])
+        for (target, field, _), value in zip(leaves, values):
+            target[field] = value
+        return decrypted
 
-        return recursive_decrypt(user_info)
+    def _decrypt_value(self, value):
+        if not isinstance(value, str):
+            raise BankIdError(code=None, description='Unexpected value for decryption')
+        return self.private_key.decrypt(b64decode(value), padding.PKCS1v15()).decode('utf8')
@@ -11,10 +11,15 @@ def extended_jwt_payload_handler(user):
     return payload
 
 
-def jwt_from_user(user):
+def jwt_from_user(user, client_id=None):
+    """
+    Issues a token starting a new token family, optionally tied to the API client by `client_id`.
+    """
     from rest_framework_jwt.settings import api_settings
+    from .tokens import start_family
     jwt_payload_handler = api_settings.JWT_PAYLOAD_HANDLER
     jwt_encode_handler = api_settings.JWT_ENCODE_HANDLER
 
     payload = jwt_payload_handler(user)
+    start_family(payload, client_id)
     return jwt_encode_handler(payload)
@@ -0,0 +1,106 @@
+import time
+import statistics
+
+from base64 import b64encode
+from tempfile import NamedTemporaryFile
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from django.core.management.base import BaseCommand
+
+from profiles.bankid import PrivatBankId
+from profiles.views import BankIDUserInfoMixin
+
+
+# Typical PrivatBank customer info, encrypted fields only
+CUSTOMER = {
+    'type': 'physical',
+    'firstName': 'ЄВГЕН',
+    'middleName': 'МИКОЛАЙОВИЧ',
+    'lastName': 'САЛО',
+    'phone': '+380961234511',
+    'inn': '1112618111',
+    'email': 'eugene.salo@email.com',
+    'birthDay': '01.01.1980',
+    'sex': 'M',
+    'addresses': [
+        {'type': address_type, 'country': 'UA', 'state': 'КИЇВСЬКА', 'area': 'КИЇВСЬКА', 'city': 'КИЇВ',
+         'street': 'ХРЕЩАТИК', 'houseNo': '1', 'flatNo': '1'}
+        for address_type in ('factual', 'birth')
+    ],
+    'documents': [
+        {'type': document_type, 'series': 'АА', 'number': '123456', 'issue': 'КИЇВСЬКИМ РВ',
+         'dateIssue': '01.01.1996', 'dateExpiration': '01.01.2026', 'issueCountryIso2': 'UA'}
+        for document_type in ('passport', 'zpassport')
+    ],
+}
+
+
+def full_declaration(customer):
+    """
+    Returns the declaration requesting every field of `customer`, which is what all of them were decrypted for.
+    """
+    declaration = {'type': customer['type'], 'fields': []}
+    for key, value in customer.items():
+        if isinstance(value, list):
+            declaration[key] = [{'type': entry['type'], 'fields': [k for k in entry if k != 'type']}
+                                for entry in value]
+        elif key != 'type':
+            declaration['fields'].append(key)
+    return declaration
+
+
+class Command(BaseCommand):
+    help = 'Measures decryption of a typical PrivatBank BankID customer info'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            dest='iterations',
+            default=50,
+            help='Number of times each case is measured, 50 by default',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            dest='workers',
+            default=4,
+            help='Number of decrypting threads of the parallel cases, 4 by default',
+        )
+
+    def handle(self, *args, **options):
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+        customer = self._encrypt(CUSTOMER, private_key.public_key())
+        with NamedTemporaryFile(suffix='.pem') as key_file:
+            key_file.write(private_key.private_bytes(encoding=serialization.Encoding.PEM,
+                                                     format=serialization.PrivateFormat.TraditionalOpenSSL,
+                                                     encryption_algorithm=serialization.NoEncryption()))
+            key_file.flush()
+            serial = PrivatBankId('client', 'secret', key_file.name, decrypt_workers=1)
+            parallel = PrivatBankId('client', 'secret', key_file.name, decrypt_workers=options['workers'])
+
+        cases = (
+            ('All fields, serial', serial, full_declaration(CUSTOMER)),
+            ('All fields, parallel', parallel, full_declaration(CUSTOMER)),
+            ('Declared fields, serial', serial, BankIDUserInfoMixin.user_info_declaration),
+            ('Declared fields, parallel', parallel, BankIDUserInfoMixin.user_info_declaration),
+        )
+        for name, client, declaration in cases:
+            # Warm up the threads
+            client._decrypt(customer, declaration)
+            timings = []
+            for _ in range(options['iterations']):
+                started_at = time.perf_counter()
+                client._decrypt(customer, declaration)
+                timings.append((time.perf_counter() - started_at) * 1000)
+            self.stdout.write('{:<28} median {:.2f} ms, min {:.2f} ms'
+                              .format(name, statistics.median(timings), min(timings)))
+
+    def _encrypt(self, value, public_key):
+        if isinstance(value, list):
+            return [self._encrypt(v, public_key) for v in value]
+        elif isinstance(value, dict):
+            return {k: (self._encrypt(v, public_key) if k != 'type' else v) for k, v in value.items()}
+        return b64encode(public_key.encrypt(value.encode('utf8'), padding.PKCS1v15())).decode('ascii')
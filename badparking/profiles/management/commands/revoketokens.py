@@ -0,0 +1,54 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from mobile_api.models import Client
+from profiles.tokens import revoke_users, revoke_clients, revoke_family
+
+
+class Command(BaseCommand):
+    help = 'Revokes JWT tokens issued to the users, through the API clients or of a token family'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            nargs='+',
+            dest='usernames',
+            default=[],
+            help='Usernames of the users to revoke the tokens of',
+        )
+        parser.add_argument(
+            '--client',
+            nargs='+',
+            dest='client_ids',
+            default=[],
+            help='IDs of the API clients to revoke the tokens of',
+        )
+        parser.add_argument(
+            '--family',
+            nargs='+',
+            dest='family_ids',
+            default=[],
+            help='Token family IDs (`fid` of the payload) to revoke',
+        )
+
+    def handle(self, *args, **options):
+        if not options['usernames'] and not options['client_ids'] and not options['family_ids']:
+            raise CommandError('Nothing to revoke')
+
+        user_ids = list(get_user_model().objects.filter(username__in=options['usernames'])
+                        .values_list('pk', flat=True))
+        if len(user_ids) != len(set(options['usernames'])):
+            raise CommandError('Some of the users do not exist')
+        try:
+            client_ids = list(Client.objects.filter(pk__in=options['client_ids']).values_list('pk', flat=True))
+        except ValueError:
+            raise CommandError('Invalid client ID')
+        if len(client_ids) != len(set(options['client_ids'])):
+            raise CommandError('Some of the clients do not exist')
+
+        revoke_users(user_ids)
+        revoke_clients(client_ids)
+        for family_id in options['family_ids']:
+            revoke_family(family_id)
+        self.stdout.write('Revoked tokens of {} users, {} clients and {} families'
+                          .format(len(user_ids), len(client_ids), len(options['family_ids'])))
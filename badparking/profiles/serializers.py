@@ -1,8 +1,13 @@
+import time
 import uuid
 
 from rest_framework import serializers
+from rest_framework_jwt.settings import api_settings
+from rest_framework_jwt.serializers import RefreshJSONWebTokenSerializer, VerifyJSONWebTokenSerializer
 from django.contrib.auth import get_user_model
 
+from .tokens import TokenRevoked, is_revoked, rotate_family
+
 User = get_user_model()
 
 
@@ -41,3 +46,36 @@ class InnUserSerializer(UserSerializer):
     def create(self, validated_data):
         validated_data['external_id'] = validated_data['inn']
         return super(InnUserSerializer, self).create(validated_data)
+
+
+class VerifyTokenSerializer(VerifyJSONWebTokenSerializer):
+    """
+    Verifies a token, which must not be revoked.
+    """
+    def _check_payload(self, token):
+        payload = super(VerifyTokenSerializer, self)._check_payload(token)
+        if is_revoked(payload):
+            raise serializers.ValidationError('Token has been revoked.')
+        return payload
+
+
+class RefreshTokenSerializer(VerifyTokenSerializer, RefreshJSONWebTokenSerializer):
+    """
+    Refreshes a token, which must not be revoked, into the next generation of its family.
+    """
+    def validate(self, attrs):
+        payload = self._check_payload(token=attrs['token'])
+        user = self._check_user(payload=payload)
+        refresh_limit = api_settings.JWT_REFRESH_EXPIRATION_DELTA.total_seconds()
+        if not payload.get('orig_iat') or time.time() > payload['orig_iat'] + refresh_limit:
+            raise serializers.ValidationError('Refresh has expired.')
+
+        new_payload = api_settings.JWT_PAYLOAD_HANDLER(user)
+        try:
+            rotate_family(payload, new_payload)
+        except TokenRevoked as exc:
+            raise serializers.ValidationError(str(exc))
+        return {
+            'token': api_settings.JWT_ENCODE_HANDLER(new_payload),
+            'user': user
+        }
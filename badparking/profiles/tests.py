@@ -1,21 +1,40 @@
 import time
-
+import json
+
+from io import StringIO
+from base64 import b64encode
+from tempfile import NamedTemporaryFile
+from threading import Thread
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
 from datetime import date
 from unittest.mock import patch
-from urllib.parse import urlencode
+from urllib.parse import urlencode, parse_qs
 from hashlib import sha256
 
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, SimpleTestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 from django.core.urlresolvers import reverse
 from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
 
 from rest_framework_jwt.settings import api_settings
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa, padding
 
 from mobile_api.models import Client
 
+from .jwt import jwt_from_user
+from .authentication import TokenUser, invalidate_user
+from .tokens import REVOKED_USER_KEY, REVOKED_CLIENT_KEY, is_revoked
 from .serializers import InnUserSerializer
 from .constants import PRIVAT_BANKID, OSCHAD_BANKID
+from .bankid import OschadBankId, PrivatBankId, BankIdError
+from .bankid.base import Token
 from .views import OschadBankOAuthCompleteLoginView, PrivatBankOAuthCompleteLoginView, BankIDUserInfoMixin
 
 
@@ -279,3 +298,294 @@ class OAuthViewsTests(TestCase):
 
             response = self.client.get(reverse('profiles>complete_login>dummy'))
             self.assertEqual(response.status_code, 404)
+
+
+class JWTAuthenticationTests(TestCase):
+    fixtures = ['test-data']
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.get(username='a9c598d399c647d18054dc70eb89b4')
+
+    def setUp(self):
+        # Cached users outlive the rolled back test transactions
+        invalidate_user(self.user.pk)
+        self.auth = 'JWT {}'.format(jwt_from_user(self.user))
+
+    def _user_queries(self, *args):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(*args, HTTP_AUTHORIZATION=self.auth)
+        return response, [q for q in context.captured_queries if User._meta.db_table in q['sql']]
+
+    def test_user_is_not_loaded(self):
+        response, queries = self._user_queries('/api/v1/claims/my')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+
+    def test_loaded_user_is_cached(self):
+        response, queries = self._user_queries('/api/v1/user/me')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['username'], self.user.username)
+        self.assertEqual(len(queries), 1)
+
+        response, queries = self._user_queries('/api/v1/user/me')
+        self.assertEqual(response.data['username'], self.user.username)
+        self.assertEqual(queries, [])
+
+    def test_deactivated_user(self):
+        self.addCleanup(cache.delete, REVOKED_USER_KEY.format(self.user.pk))
+        self.user.is_active = False
+        self.user.save()
+        response, _ = self._user_queries('/api/v1/user/me')
+        self.assertIn(response.status_code, (401, 403))
+
+    def test_outdated_completion(self):
+        payload = jwt_decode_handler(self.auth.split()[1])
+        payload['is_complete'] = False
+        user = TokenUser(payload)
+        self.assertTrue(user.is_complete())
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertTrue(user.is_authenticated())
+
+
+class TokenRevocationTests(TestCase):
+    fixtures = ['test-data']
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.get(username='a9c598d399c647d18054dc70eb89b4')
+        cls.api_client = Client.objects.get(id='9a6291c1-ef6d-4d81-b6dd-a1699b4b78f0')
+
+    def setUp(self):
+        # Revocations are kept in the cache, which outlives the tests
+        self.addCleanup(cache.delete_many, [REVOKED_USER_KEY.format(self.user.pk),
+                                            REVOKED_CLIENT_KEY.format(self.api_client.pk)])
+
+    def _get(self, token):
+        return self.client.get('/api/v1/claims/my', HTTP_AUTHORIZATION='JWT {}'.format(token))
+
+    def _refresh(self, token):
+        return self.client.post('/api/v1/token/refresh', {'token': token})
+
+    def test_refresh_rotates_family(self):
+        token = jwt_from_user(self.user)
+        response = self._refresh(token)
+        self.assertEqual(response.status_code, 200)
+        refreshed = response.data['token']
+        payload, refreshed_payload = jwt_decode_handler(token), jwt_decode_handler(refreshed)
+        self.assertEqual(refreshed_payload['fid'], payload['fid'])
+        self.assertEqual(refreshed_payload['gen'], payload['gen'] + 1)
+        self.assertEqual(refreshed_payload['orig_iat'], payload['orig_iat'])
+        self.assertEqual(self._get(refreshed).status_code, 200)
+
+        # Refreshing the same token again means it has leaked
+        self.assertEqual(self._refresh(token).status_code, 400)
+        self.assertEqual(self._get(refreshed).status_code, 401)
+        self.assertEqual(self._refresh(refreshed).status_code, 400)
+
+        # Other families are not affected
+        self.assertEqual(self._get(jwt_from_user(self.user)).status_code, 200)
+
+    def test_revoke_user(self):
+        token = jwt_from_user(self.user)
+        self.assertEqual(self._get(token).status_code, 200)
+        call_command('revoketokens', user=[self.user.username], stdout=StringIO())
+        self.assertEqual(self._get(token).status_code, 401)
+        response = self.client.post('/api/v1/token/verify', {'token': token})
+        self.assertEqual(response.status_code, 400)
+
+    def test_revoke_client(self):
+        token = jwt_from_user(self.user, self.api_client.pk)
+        other_token = jwt_from_user(self.user)
+        call_command('revoketokens', client=[str(self.api_client.pk)], stdout=StringIO())
+        self.assertEqual(self._get(token).status_code, 401)
+        self.assertEqual(self._get(other_token).status_code, 200)
+
+    def test_single_round_trip(self):
+        payload = jwt_decode_handler(jwt_from_user(self.user, self.api_client.pk))
+        with patch.object(cache, 'get_many', wraps=cache.get_many) as get_many, patch.object(cache, 'get') as get:
+            self.assertFalse(is_revoked(payload))
+            self.assertEqual(get_many.call_count, 1)
+            get.assert_not_called()
+
+
+class FakeOAuthServer(ThreadingMixIn, HTTPServer):
+    """
+    Local stand-in for a BankID provider.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super(FakeOAuthServer, self).__init__(('127.0.0.1', 0), FakeOAuthHandler)
+        self.user_info = {}
+        self.failures = 0  # Number of requests to fail before responding
+        self.delay = 0  # Seconds to wait before responding
+        self.requests = []  # Path, body and client address of each request
+
+    @property
+    def url(self):
+        return 'http://{}:{}/v1/'.format(*self.server_address)
+
+    def handle_error(self, request, client_address):
+        # Clients timing out close the connection before the response is written
+        pass
+
+
+class FakeOAuthHandler(BaseHTTPRequestHandler):
+    # Keep connections alive
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf8')
+        self.server.requests.append((self.path, body, self.client_address))
+        time.sleep(self.server.delay)
+        if self.server.failures:
+            self.server.failures -= 1
+            self._respond(503, {})
+        elif self.path == '/v1/bank/oauth2/token':
+            data = parse_qs(body)
+            if data.get('code') == ['valid'] or data.get('refresh_token') == ['refresh']:
+                self._respond(200, {'access_token': 'access', 'refresh_token': 'refresh', 'expires_in': 180,
+                                    'token_type': 'Bearer'})
+            else:
+                self._respond(400, {'error': 'invalid_grant', 'error_description': 'Invalid code'})
+        elif self.path == '/v1/bank/resource/client':
+            self._respond(200, self.server.user_info)
+        else:
+            self._respond(404, {})
+
+    def _respond(self, status, data):
+        body = json.dumps(data).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class BankIdClientTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(BankIdClientTests, cls).setUpClass()
+        cls.server = FakeOAuthServer()
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super(BankIdClientTests, cls).tearDownClass()
+
+    def setUp(self):
+        self.server.user_info = {}
+        self.server.failures = 0
+        self.server.delay = 0
+        self.server.requests = []
+
+    def _client(self, **kwargs):
+        kwargs.setdefault('backoff_factor', 0)
+        return OschadBankId('client', 'secret', api_base_url=self.server.url, **kwargs)
+
+    def test_token_and_user_info(self):
+        self.server.user_info = {'state': 'ok', 'customer': {'inn': '1112618111'}}
+        client = self._client()
+        token = client.retrieve_access_token('valid', 'http://localhost/complete')
+        self.assertEqual(token, Token('access', 'refresh', 180, 'Bearer'))
+        self.assertEqual(client.user_info(token, {'type': 'physical'}), self.server.user_info)
+        self.assertEqual(client.refresh_access_token(token).access_token, 'access')
+
+        # All the requests are sent over a single kept alive connection
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len({address for _, _, address in self.server.requests}), 1)
+
+    def test_provider_error(self):
+        with self.assertRaises(BankIdError) as context:
+            self._client().retrieve_access_token('invalid', 'http://localhost/complete')
+        self.assertEqual(context.exception.code, 'invalid_grant')
+
+    def test_unavailable(self):
+        self.server.failures = 1
+        with self.assertRaises(BankIdError) as context:
+            self._client(retries=2).retrieve_access_token('valid', 'http://localhost/complete')
+        self.assertEqual(context.exception.code, None)
+        # The gateway may have passed the code on already, so the request is not repeated
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_timeout(self):
+        self.server.delay = 0.5
+        with self.assertRaises(BankIdError):
+            self._client(timeout=(1, 0.1)).retrieve_access_token('valid', 'http://localhost/complete')
+        # The code may have been used already, so the request is not repeated
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_connection_error(self):
+        client = OschadBankId('client', 'secret', api_base_url='http://127.0.0.1:1/', retries=1, backoff_factor=0)
+        with self.assertRaises(BankIdError):
+            client.retrieve_access_token('valid', 'http://localhost/complete')
+
+
+class PrivatBankDecryptionTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(PrivatBankDecryptionTests, cls).setUpClass()
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=1024, backend=default_backend())
+        cls.public_key = private_key.public_key()
+        with NamedTemporaryFile(suffix='.pem') as key_file:
+            key_file.write(private_key.private_bytes(encoding=serialization.Encoding.PEM,
+                                                     format=serialization.PrivateFormat.TraditionalOpenSSL,
+                                                     encryption_algorithm=serialization.NoEncryption()))
+            key_file.flush()
+            cls.bankid = PrivatBankId('client', 'secret', key_file.name)
+
+    def _encrypt(self, value):
+        return b64encode(self.public_key.encrypt(value.encode('utf8'), padding.PKCS1v15())).decode('ascii')
+
+    def test_declared_fields(self):
+        customer = {
+            'type': 'physical',
+            'signature': 'signature',
+            'inn': self._encrypt('1112618111'),
+            'email': self._encrypt('eugene.salo@email.com'),
+            'birthDay': self._encrypt('01.01.1980'),
+            'addresses': [
+                {'type': 'factual', 'city': self._encrypt('КИЇВ'), 'street': self._encrypt('ХРЕЩАТИК')},
+                {'type': 'birth', 'city': self._encrypt('ЛЬВІВ')},
+            ],
+            'documents': [{'type': 'passport', 'number': self._encrypt('123456')}],
+        }
+        declaration = {
+            'type': 'physical',
+            'fields': ['inn', 'email', 'phone'],
+            'addresses': [{'type': 'factual', 'fields': ['city']}],
+        }
+        self.assertEqual(self.bankid._decrypt(customer, declaration), {
+            'type': 'physical',
+            'signature': 'signature',
+            'inn': '1112618111',
+            'email': 'eugene.salo@email.com',
+            'addresses': [{'type': 'factual', 'city': 'КИЇВ'}],
+        })
+
+    def test_login_declaration(self):
+        customer = {'type': 'physical', 'signature': 'signature', 'firstName': self._encrypt('ЄВГЕН'),
+                    'lastName': self._encrypt('САЛО'), 'inn': self._encrypt('1112618111')}
+        data = self.bankid._decrypt(customer, BankIDUserInfoMixin.user_info_declaration)
+        self.assertEqual(BankIDUserInfoMixin()._map_user_info({'customer': data}), {
+            'first_name': 'ЄВГЕН',
+            'middle_name': '',
+            'last_name': 'САЛО',
+            'inn': '1112618111'
+        })
+
+    def test_unexpected_value(self):
+        with self.assertRaises(BankIdError):
+            self.bankid._decrypt({'type': 'physical', 'inn': 1112618111}, {'fields': ['inn']})
+
+    def test_benchmark(self):
+        out = StringIO()
+        call_command('benchmarkbankid', iterations=1, workers=2, stdout=out)
+        self.assertIn('Declared fields, parallel', out.getvalue())
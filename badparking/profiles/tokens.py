@@ -0,0 +1,96 @@
+import time
+
+from uuid import uuid4
+
+from django.core.cache import cache
+from rest_framework_jwt.settings import api_settings
+
+
+# Current generation of a token family, the number of times it has been refreshed
+FAMILY_KEY = 'profiles:token_family:{}'
+# Timestamps, tokens of the family, user or client originally issued at or before them are revoked
+REVOKED_FAMILY_KEY = 'profiles:revoked:family:{}'
+REVOKED_USER_KEY = 'profiles:revoked:user:{}'
+REVOKED_CLIENT_KEY = 'profiles:revoked:client:{}'
+
+
+class TokenRevoked(Exception):
+    pass
+
+
+def _family_timeout():
+    # No token of a family outlives the refresh expiration, neither need the keys
+    return int(api_settings.JWT_REFRESH_EXPIRATION_DELTA.total_seconds())
+
+
+def start_family(payload, client_id=None):
+    """
+    Makes `payload` of a newly issued token the first generation of a new token family. `client_id` of the API client
+    the token is issued through allows to revoke the tokens by the client.
+    """
+    payload['fid'] = uuid4().hex
+    payload['gen'] = 0
+    if client_id:
+        payload['cid'] = str(client_id)
+    cache.set(FAMILY_KEY.format(payload['fid']), 0, _family_timeout())
+
+
+def rotate_family(payload, new_payload):
+    """
+    Makes `new_payload` the next generation of the family of the refreshed token `payload`.
+
+    Each token may only be refreshed once. Refreshing an older generation means that the token has leaked, the whole
+    family is revoked and `TokenRevoked` raised then. Tokens issued before families start a new one.
+    """
+    new_payload['orig_iat'] = payload['orig_iat']
+    if 'fid' not in payload:
+        start_family(new_payload)
+        return
+    try:
+        # Atomic, of concurrent refreshes of the same token only one gets the next generation
+        generation = cache.incr(FAMILY_KEY.format(payload['fid']))
+    except ValueError:
+        raise TokenRevoked('Token family has expired')
+    if generation != payload['gen'] + 1:
+        revoke_family(payload['fid'])
+        raise TokenRevoked('Token has been refreshed already')
+    new_payload['fid'] = payload['fid']
+    new_payload['gen'] = generation
+    if 'cid' in payload:
+        new_payload['cid'] = payload['cid']
+
+
+def is_revoked(payload):
+    """
+    Checks the family, user and client of the token `payload` for revocation in a single cache round trip.
+    """
+    keys = [REVOKED_USER_KEY.format(payload.get('user_id'))]
+    if 'fid' in payload:
+        keys.append(REVOKED_FAMILY_KEY.format(payload['fid']))
+    if 'cid' in payload:
+        keys.append(REVOKED_CLIENT_KEY.format(payload['cid']))
+    issued_at = payload.get('orig_iat', 0)
+    return any(issued_at <= revoked_at for revoked_at in cache.get_many(keys).values())
+
+
+def _revoke(key_format, ids):
+    now = int(time.time())
+    cache.set_many({key_format.format(i): now for i in ids}, _family_timeout())
+
+
+def revoke_family(family_id):
+    _revoke(REVOKED_FAMILY_KEY, [family_id])
+
+
+def revoke_users(user_ids):
+    """
+    Revokes all the tokens issued to the users so far.
+    """
+    _revoke(REVOKED_USER_KEY, user_ids)
+
+
+def revoke_clients(client_ids):
+    """
+    Revokes all the tokens issued through the API clients so far.
+    """
+    _revoke(REVOKED_CLIENT_KEY, [str(client_id) for client_id in client_ids])
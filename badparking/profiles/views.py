@@ -8,6 +8,7 @@ from django.apps import apps
 from django.conf import settings
 
 from mobile_api.models import Client
+from mobile_api.cache import get_active_client
 from .serializers import UserSerializer, InnUserSerializer
 from .constants import OSCHAD_BANKID, PRIVAT_BANKID
 from .bankid import BankIdError
@@ -38,11 +39,13 @@ class OAuthLoginView(View):
             return HttpResponseBadRequest()
 
         try:
-            client = Client.objects.get(id=client_id, is_active=True)
+            client = get_active_client(client_id)
             client.verify_secret(client_secret, timestamp, raise_exception=True)
         except (Client.DoesNotExist, ValueError):
             return HttpResponseForbidden()
 
+        # Tie the issued token to the client once the flow completes
+        request.session['oauth_client_id'] = str(client.pk)
         return HttpResponseRedirect(self._authorization_url(request))
 
     def _authorization_url(self, request):
@@ -83,7 +86,7 @@ class OAuthCompleteLoginView(View):
             logger.error(serializer.errors, extra={'request': request})
             return HttpResponseBadRequest('Invalid user data', content_type='text/plain')
         user = serializer.save()
-        token = jwt_from_user(user)
+        token = jwt_from_user(user, request.session.pop('oauth_client_id', None))
 
         response = HttpResponse('Authentication complete', content_type='text/plain')
         response['X-JWT'] = token